@@ -1,17 +1,26 @@
 import networkx as nx
+import numpy as np
 from typing import List, Dict
 
 
 class AbstractAgent(object):
-    def __init__(self, public_key: str, initial_funds: int, channel_cost: int):
+    def __init__(self, public_key: str, initial_funds: int, channel_cost: int, rng: np.random.Generator = None):
         self.pub_key: str = public_key
         self.initial_funds: int = initial_funds
         self.channel_cost = channel_cost
+        # The random generator of the agent's choices (by default a new one, seeded from the OS).
+        self.rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
 
     @property
     def name(self) -> str:
         raise NotImplementedError("The agent must declare its name.")
 
+    def sample_nodes(self, nodes: List, k: int) -> List:
+        """
+        :return: k distinct nodes sampled uniformly from the given nodes (using the agent's random generator).
+        """
+        return [nodes[i] for i in self.rng.choice(len(nodes), size=k, replace=False)]
+
     def get_channels(self, graph: nx.MultiGraph) -> List[Dict]:
         """
         This function gets the graph as and return the channels the agent wants to create.
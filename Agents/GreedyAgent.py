@@ -1,11 +1,13 @@
-import random
-from collections import defaultdict
-from random import randint
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import networkx as nx
+import numpy as np
 
 from Agents.AbstractAgent import AbstractAgent
-from routing.LND_routing import get_route
+from routing.LND_routing import get_routes_to_target
+from utils.caching import LRUCache, graph_fingerprint, load_pickle, save_pickle
 from utils.common import get_agent_policy
 
 # Those numbers are used in the LND routing algorithm that is used to sort edges by their attractiveness for
@@ -15,6 +17,19 @@ from utils.common import get_agent_policy
 ROUTENESS_MAX_TRANSFER_AMOUNT = 10 ** 6
 ROUTENESS_MIN_TRANSFER_AMOUNT = 10 ** 5
 
+# The seed of the transferred amounts of the routeness computation.
+# The routeness is a property of the graph which is cached and shared by all of the agents and repeats (see below),
+# so its amounts are drawn from a fixed seed rather than from the random generator of the caller.
+ROUTENESS_SEED = 0
+
+# The routes sweep of the routeness computation depends only on the graph (and the transferred amounts),
+# so its result is cached per graph and reused by the following calls (e.g. the iterations of find_best_k_nodes,
+# the repeats of an experiment and the different agents).
+# Set ROUTENESS_CACHE_DIR to a directory in order to persist the cache between runs as well.
+ROUTENESS_CACHE_SIZE = 16
+ROUTENESS_CACHE_DIR = None
+_routeness_cache = LRUCache(max_size=ROUTENESS_CACHE_SIZE)
+
 
 def sort_nodes_by_total_capacity(graph, minimize: bool):
     """
@@ -102,44 +117,31 @@ def grouped(iterable, number_to_group):
     return zip(*[iter(iterable)] * number_to_group)
 
 
-def sort_nodes_by_routeness(graph, minimize: bool):
+def count_participated_edges(graph, targets_and_amounts) -> Counter:
     """
-    For each (ordered) pair of nodes in the graph we find the route for a transaction between them according to the LND
-     routing algorithm. During this process we maintain a counter for each (unordered) pair of channels in the graph
-     that is adjacend in a route (meaning that these are channels between Alice and Bob and between Bob and
-     Charlie - there is a common node in the two). For every route between two nodes, the counter for each pair of
-     channels in the route is increased by one.
-
-    After we finish going over every pair of nodes in graph, we have the counters for each pair of channels in the
-    graph. We sort the channels according to their counter - high values means pairs of channels that participate
-    often in routes in the graph. We take to top nodes from this pairs of channels and establish channels with them
-    in order to enable bypassing through our nodes instead of the middle node in the pair of channels.
+    Count for each (unordered) pair of adjacent channels the number of routes it participates in,
+    going over the routes from all of the nodes to each of the given targets.
 
     :param graph: lightning graph
-    :param minimize: boolean indicator To choose which strategy to choose (i.e maximal or minimal betweenness)
-    :return:
-            (1) list of nodes that have the maximal betweenness
-                (i.e nodes that participated in the maximum number of shortest path).
-            (2) dictionary of nodes in (1) with their rank according to the routeness score for their edges
+    :param targets_and_amounts: list of tuples (target node, amount to transfer to it in the routing)
+    :return: A Counter mapping each pair of channels to the number of routes it participates in.
     """
-
     # Create a dictionary that the key are group of two edges in the graph with a counter that
     # indicate how many short-paths pass through them (according to lnd protocol)
-    participated_edges_counter = defaultdict(lambda: 0)
-    # Nodes that participate in the maximal routeness, in an order way
-    ordered_nodes_with_maximal_routeness = list()
-
-    # Traverse all routes between the nodes in the graph (O(N^2)*T(LND)), getting the route according the lnd_routing
-    for src in graph.nodes():
-        for dest in graph.nodes():
-            if dest == src or dest in graph.neighbors(src):
-                continue  # Early termination for cases where a two edges fastest route cannot exist
+    participated_edges_counter = Counter()
 
-            amount = randint(ROUTENESS_MIN_TRANSFER_AMOUNT, ROUTENESS_MAX_TRANSFER_AMOUNT)
+    # Traverse all routes between the nodes in the graph, getting the route according the lnd_routing.
+    # The routes to the same target are computed together in a single run of the routing algorithm (O(N)*T(LND)).
+    for dest, amount in targets_and_amounts:
+        # Early termination for cases where a two edges fastest route cannot exist
+        dest_neighbors = set(graph.neighbors(dest))
+        sources = [src for src in graph.nodes() if src != dest and src not in dest_neighbors]
 
-            # Get the path from node1 to node2 according the lnd_routing algorithm
-            route = get_route(graph, src, dest, amount)
+        # Get the paths from all sources to dest according the lnd_routing algorithm
+        routes = get_routes_to_target(graph, dest, amount, sources)
 
+        for src in sources:
+            route = routes[src]
             if route is None:
                 continue  # No route was found transferring 'amount; from 'source' to 'target',
             assert len(route) > 1  # This should not happen: we verified no short route can exist
@@ -157,6 +159,119 @@ def sort_nodes_by_routeness(graph, minimize: bool):
                 key = frozenset([key_edge1_data, key_edge2_data])
                 participated_edges_counter[key] += 1
 
+    return participated_edges_counter
+
+
+# The graph of a worker process of the routeness computation (see count_participated_edges_in_parallel).
+_worker_graph = None
+
+
+def _init_routeness_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _count_participated_edges_in_worker(targets_and_amounts) -> Counter:
+    return count_participated_edges(_worker_graph, targets_and_amounts)
+
+
+def count_participated_edges_in_parallel(graph, targets_and_amounts, workers: int) -> Counter:
+    """
+    The same as count_participated_edges, but the targets are split to contiguous shards that are processed by
+    a pool of worker processes. The graph is sent once to each worker (when the workers are forked it's not even
+    copied), and the counters of the shards are merged in the order of the shards, so the result (including the
+    order of the keys) is identical to count_participated_edges.
+
+    :param graph: lightning graph
+    :param targets_and_amounts: list of tuples (target node, amount to transfer to it in the routing)
+    :param workers: The number of worker processes.
+    :return: A Counter mapping each pair of channels to the number of routes it participates in.
+    """
+    shard_size = -(-len(targets_and_amounts) // workers)  # Ceiling division
+    shards = [targets_and_amounts[i:i + shard_size] for i in range(0, len(targets_and_amounts), shard_size)]
+
+    participated_edges_counter = Counter()
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_routeness_worker, initargs=(graph,)) as executor:
+        for shard_counter in executor.map(_count_participated_edges_in_worker, shards):
+            participated_edges_counter.update(shard_counter)
+
+    return participated_edges_counter
+
+
+def get_participated_edges_counter(graph, workers: int = 1, use_cache: bool = True,
+                                   seed: int = ROUTENESS_SEED) -> Counter:
+    """
+    Count for each (unordered) pair of adjacent channels the number of routes it participates in,
+    going over the routes between every (ordered) pair of nodes in the graph.
+    The result is cached by the graph's fingerprint (its nodes, channels and policies), the amounts range and the
+    seed, in memory and in ROUTENESS_CACHE_DIR (if it's set).
+
+    :param graph: lightning graph
+    :param workers: The number of worker processes to compute the routes with (1 means no worker processes).
+    :param use_cache: If False, always compute the counter (and do not cache it).
+    :param seed: The seed of the random transferred amounts.
+    :return: A Counter mapping each pair of channels to the number of routes it participates in.
+             Note that it might be shared with other callers, so it should not be modified.
+    """
+    if use_cache:
+        cache_key = f'{graph_fingerprint(graph)}-{ROUTENESS_MIN_TRANSFER_AMOUNT}-{ROUTENESS_MAX_TRANSFER_AMOUNT}-{seed}'
+        cache_path = None if ROUTENESS_CACHE_DIR is None else os.path.join(ROUTENESS_CACHE_DIR,
+                                                                           f'routeness-{cache_key}.pkl')
+        participated_edges_counter = _routeness_cache.get(cache_key)
+        if participated_edges_counter is None and cache_path is not None:
+            participated_edges_counter = load_pickle(cache_path)
+        if participated_edges_counter is not None:
+            _routeness_cache.put(cache_key, participated_edges_counter)
+            return participated_edges_counter
+
+    # The amounts are drawn here (and not in the workers) so the result does not depend on the number of workers.
+    amounts = np.random.default_rng(seed).integers(ROUTENESS_MIN_TRANSFER_AMOUNT, ROUTENESS_MAX_TRANSFER_AMOUNT,
+                                                   size=len(graph), endpoint=True)
+    targets_and_amounts = [(dest, int(amount)) for dest, amount in zip(graph.nodes(), amounts)]
+
+    if workers > 1:
+        participated_edges_counter = count_participated_edges_in_parallel(graph, targets_and_amounts, workers)
+    else:
+        participated_edges_counter = count_participated_edges(graph, targets_and_amounts)
+
+    if use_cache:
+        _routeness_cache.put(cache_key, participated_edges_counter)
+        if cache_path is not None:
+            save_pickle(participated_edges_counter, cache_path)
+
+    return participated_edges_counter
+
+
+def sort_nodes_by_routeness(graph, minimize: bool, workers: int = 1, use_cache: bool = True,
+                            seed: int = ROUTENESS_SEED):
+    """
+    For each (ordered) pair of nodes in the graph we find the route for a transaction between them according to the LND
+     routing algorithm. During this process we maintain a counter for each (unordered) pair of channels in the graph
+     that is adjacend in a route (meaning that these are channels between Alice and Bob and between Bob and
+     Charlie - there is a common node in the two). For every route between two nodes, the counter for each pair of
+     channels in the route is increased by one.
+
+    After we finish going over every pair of nodes in graph, we have the counters for each pair of channels in the
+    graph. We sort the channels according to their counter - high values means pairs of channels that participate
+    often in routes in the graph. We take to top nodes from this pairs of channels and establish channels with them
+    in order to enable bypassing through our nodes instead of the middle node in the pair of channels.
+
+    :param graph: lightning graph
+    :param minimize: boolean indicator To choose which strategy to choose (i.e maximal or minimal betweenness)
+    :param workers: The number of worker processes to compute the routes with (1 means no worker processes).
+    :param use_cache: If False, compute the routes even if the result for this graph is cached.
+    :param seed: The seed of the random transferred amounts.
+    :return:
+            (1) list of nodes that have the maximal betweenness
+                (i.e nodes that participated in the maximum number of shortest path).
+            (2) dictionary of nodes in (1) with their rank according to the routeness score for their edges
+    """
+    participated_edges_counter = get_participated_edges_counter(graph, workers, use_cache, seed)
+
+    # Nodes that participate in the maximal routeness, in an order way
+    ordered_nodes_with_maximal_routeness = list()
+
     # Sort the dictionary according to the values (i.e group of two edges that have passed through the mose
     # time are at the start/end according the minimize indicator)
     sorted_participated_edges_counter = sorted(participated_edges_counter.items(), key=lambda item: item[1],
@@ -189,8 +304,11 @@ def sort_nodes_by_routeness(graph, minimize: bool):
 class GreedyNodeInvestor(AbstractAgent):
     def __init__(self, public_key: str, initial_funds: int, channel_cost: int,
                  minimize=False, use_node_degree=False, use_node_routeness=False, desired_num_edges=10,
-                 use_default_policy=True, fee: int = None, n_channels_per_node: int = 2):
-        super(GreedyNodeInvestor, self).__init__(public_key, initial_funds, channel_cost)
+                 use_default_policy=True, fee: int = None, n_channels_per_node: int = 2, routeness_workers: int = 1,
+                 rng: np.random.Generator = None):
+        super(GreedyNodeInvestor, self).__init__(public_key, initial_funds, channel_cost, rng)
+
+        self.routeness_workers = routeness_workers
 
         self.n_channels_per_node = n_channels_per_node
         self.fee = fee
@@ -217,7 +335,7 @@ class GreedyNodeInvestor(AbstractAgent):
         if self.use_node_degree:
             nodes_to_surround, _ = sort_nodes_by_degree(graph, self.minimize)
         elif self.use_node_routeness:
-            nodes_to_surround, _ = sort_nodes_by_routeness(graph, self.minimize)
+            nodes_to_surround, _ = sort_nodes_by_routeness(graph, self.minimize, self.routeness_workers)
         else:
             nodes_to_surround = sort_nodes_by_total_capacity(graph, self.minimize)
 
@@ -234,7 +352,7 @@ class GreedyNodeInvestor(AbstractAgent):
                 # Gets node neighbors to connect with
                 node_neighbors = [n for n in graph.neighbors(node) if n not in nodes_in_already_chosen_edges]
                 if len(node_neighbors) > self.n_channels_per_node:
-                    nodes_to_connect_with = random.sample(node_neighbors, k=self.n_channels_per_node)
+                    nodes_to_connect_with = self.sample_nodes(node_neighbors, k=self.n_channels_per_node)
                 else:
                     nodes_to_connect_with = node_neighbors
 
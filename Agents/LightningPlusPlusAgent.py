@@ -1,4 +1,3 @@
-import random
 from typing import List, Dict
 
 import matplotlib.pyplot as plt
@@ -7,43 +6,18 @@ import numpy as np
 
 from Agents.AbstractAgent import AbstractAgent
 from Agents.GreedyAgent import sort_nodes_by_routeness, sort_nodes_by_degree
+from LightningGraph.hop_distances import build_hop_distance_matrix, hop_distances_to_float
 from utils.common import get_agent_policy
+from utils.graph_helpers import get_graph_positions
 
 
-def get_distances_probability_vector(possible_nodes_mask: np.ndarray,
-                                     distance_matrix: np.ndarray,
-                                     alpha: float = 3) -> np.ndarray:
+def min_distances_to_probability_vector(weights_vector: np.ndarray, alpha: float = 3) -> np.ndarray:
     """
-    Get the distances probability vector for the nodes in the graph.
-    Sampling a node according to this probability vector will (probably) result
-    in a node that is far away from the already chosen nodes.
-
-    :param possible_nodes_mask: A boolean NumPy array indicating whether the relevant node is
-                                possible for selection or was it selected already.
-    :param distance_matrix: A 2D NumPy array which is the distance between every two vertices
-                            in the graph. Speeds up the run-time of this function.
+    :param weights_vector: A NumPy array containing the weight of each node, which is its minimal distance to a
+                           previously selected node (np.inf for nodes that can not reach any selected node).
     :param alpha: The power to raise the weights vector before dividing by the sum.
-                  Higher values enlarge the differences between the resulting probabilities.
     :return: A NumPy array that is the probability vector for the nodes in the graph.
     """
-    n = len(possible_nodes_mask)
-
-    # This is a mask indicating the previously selected nodes.
-    selected_nodes_mask = ~possible_nodes_mask
-
-    # If all node are possible for the selection (meaning there are no nodes that
-    # were already selected), the distances are undefined.
-    # Return the all ones weight vector, so all nodes have the same weight.
-    if np.all(possible_nodes_mask):
-        weights_vector = np.ones(shape=n, dtype=np.float32)
-
-    # Now we know that some nodes were selected, and the distances are well defined.
-    # The weight of each node will be the minimal distance to a previously selected node.
-    else:
-        weights_vector = np.empty(shape=n, dtype=np.float32)
-        for i, distances in enumerate(distance_matrix):
-            weights_vector[i] = np.min(distances[selected_nodes_mask])
-
     weights_to_the_power_of_alpha = weights_vector ** alpha
     weights_to_the_power_of_alpha[weights_to_the_power_of_alpha == np.inf] = 0
     probability_vector = weights_to_the_power_of_alpha / weights_to_the_power_of_alpha.sum()
@@ -51,111 +25,124 @@ def get_distances_probability_vector(possible_nodes_mask: np.ndarray,
     return probability_vector
 
 
-def get_capacities_probability_vector(graph: nx.MultiGraph,
-                                      nodes: list,
-                                      possible_nodes_mask: np.ndarray,
-                                      alpha: float = 3, minimize: bool = False) -> np.ndarray:
+def features_to_probability_vector(features: np.ndarray, possible_nodes_mask: np.ndarray,
+                                   alpha: float = 3) -> np.ndarray:
     """
-    Get the capacities probability vector for the nodes in the graph.
-    Sampling a node according to this probability vector will (probably)
-    result in a node with high capacity.
-
-    :param graph: The graph.
-    :param nodes: A list of the nodes in the graph.
-                  This is important because we want the order of the nodes to be the same,
-                  and calling graph.nodes does not necessarily maintain the order.
+    :param features: A NumPy array containing the score of each node (e.g. its capacity).
     :param possible_nodes_mask: A boolean NumPy array indicating whether the relevant node is possible for selection
                                 or was it selected already.
-    :param alpha: The power to raise the capacities before dividing by the sum.
-                  Higher values enlarge the differences between the resulting probabilities
-                  for node with different capacities.
+    :param alpha: The power to raise the scores before dividing by the sum.
+                  Higher values enlarge the differences between the resulting probabilities.
     :return: A NumPy array that is a probability vector for the nodes in the graph.
     """
-    capacities_per_node = nx.get_node_attributes(graph, 'total_capacity')
-    if minimize:
-        capacities_per_node = {key: (1.0 / value) for key, value in capacities_per_node.items()}
-
-    capacities = np.array([capacities_per_node[node] for node in nodes])
-    capacities[~possible_nodes_mask] = 0
-    q = capacities / capacities.sum()
+    features = features.copy()
+    features[~possible_nodes_mask] = 0
+    q = features / features.sum()
     q_to_the_power_of_alpha = q ** alpha
     p = q_to_the_power_of_alpha / q_to_the_power_of_alpha.sum()
 
     return p
 
 
-def get_degree_probability_vector(graph: nx.MultiGraph,
-                                  nodes: list,
-                                  possible_nodes_mask: np.ndarray,
-                                  alpha: float = 3, minimize: bool = False) -> np.ndarray:
+def get_capacities_vector(graph: nx.MultiGraph, nodes: list, minimize: bool = False) -> np.ndarray:
+    """
+    :param graph: The graph.
+    :param nodes: A list of the nodes in the graph (defines the order of the resulting vector).
+    :param minimize: If True, the score of each node is the inverse of its total capacity.
+    :return: A NumPy array containing the total capacity of each node (or its inverse).
     """
-    Get the degrees probability vector for the nodes in the graph.
-    Sampling a node according to this probability vector will (probably)
-    result in a node with high degree.
+    capacities_per_node = nx.get_node_attributes(graph, 'total_capacity')
+    if minimize:
+        capacities_per_node = {key: (1.0 / value) for key, value in capacities_per_node.items()}
+
+    return np.array([capacities_per_node[node] for node in nodes])
 
-    :param minimize: Boolean indicator To choose which strategy to choose (i.e maximal or minimal degree)
+
+def get_degrees_vector(graph: nx.MultiGraph, nodes: list, minimize: bool = False) -> np.ndarray:
+    """
     :param graph: The graph.
-    :param nodes: A list of the nodes in the graph.
-                  This is important because we want the order of the nodes to be the same,
-                  and calling graph.nodes does not necessarily maintain the order.
-    :param possible_nodes_mask: A boolean NumPy array indicating whether the relevant node is possible for selection
-                                or was it selected already.
-    :param alpha: The power to raise the capacities before dividing by the sum.
-                  Higher values enlarge the differences between the resulting probabilities
-                  for node with different degrees.
-    :return: A NumPy array that is a probability vector for the nodes in the graph.
+    :param nodes: A list of the nodes in the graph (defines the order of the resulting vector).
+    :param minimize: If True, the score of each node is the inverse of its degree.
+    :return: A NumPy array containing the degree of each node (or its inverse).
     """
     _, nodes_degree = sort_nodes_by_degree(graph, minimize=minimize)
     degree_per_node = {key: value for key, value in nodes_degree}
     if minimize:
         degree_per_node = {key: (1.0 / value) for key, value in nodes_degree}
 
-    degrees = np.array([degree_per_node[node] for node in nodes])
-    degrees[~possible_nodes_mask] = 0
-
-    q = degrees / degrees.sum()
-    q_to_the_power_of_alpha = q ** alpha
-    p = q_to_the_power_of_alpha / q_to_the_power_of_alpha.sum()
-
-    return p
+    return np.array([degree_per_node[node] for node in nodes])
 
 
-def get_routeness_probability_vector(graph: nx.MultiGraph,
-                                     nodes: list,
-                                     possible_nodes_mask: np.ndarray,
-                                     alpha: float = 3, minimize: bool = False) -> np.ndarray:
+def get_routeness_vector(graph: nx.MultiGraph, nodes: list, minimize: bool = False, workers: int = 1) -> np.ndarray:
+    """
+    :param graph: The graph.
+    :param nodes: A list of the nodes in the graph (defines the order of the resulting vector).
+    :param minimize: If True, the score of each node is the inverse of its routeness.
+    :param workers: The number of worker processes to compute the routes with (1 means no worker processes).
+    :return: A NumPy array containing the routeness of each node (or its inverse).
     """
-       Get the routeness probability vector for the nodes in the graph.
-       Sampling a node according to this probability vector will (probably)
-       result in a node with high routeness.
-
-       :param minimize: Boolean indicator To choose which strategy to choose (i.e maximal or minimal routeness)
-       :param graph: The graph.
-       :param nodes: A list of the nodes in the graph.
-                     This is important because we want the order of the nodes to be the same,
-                     and calling graph.nodes does not necessarily maintain the order.
-       :param possible_nodes_mask: A boolean NumPy array indicating whether the relevant node is possible for selection
-                                   or was it selected already.
-       :param alpha: The power to raise the capacities before dividing by the sum.
-                     Higher values enlarge the differences between the resulting probabilities
-                     for node with different routeness.
-       :return: A NumPy array that is a probability vector for the nodes in the graph.
-       """
-
-    _, routeness_per_node = sort_nodes_by_routeness(graph, minimize)
+    _, routeness_per_node = sort_nodes_by_routeness(graph, minimize, workers)
     if minimize:
         routeness_per_node = {key: (1.0 / value) for key, value in routeness_per_node.items()}
 
-    routeness = np.array([routeness_per_node[node] for node in nodes])
+    return np.array([routeness_per_node[node] for node in nodes])
 
-    routeness[~possible_nodes_mask] = 0
-    q = routeness / routeness.sum()
-    q_to_the_power_of_alpha = q ** alpha
-    p = q_to_the_power_of_alpha / q_to_the_power_of_alpha.sum()
-    return p
 
+class IncrementalNodesSelector:
+    """
+    Maintains the state of the nodes selection of find_best_k_nodes incrementally:
+    the features vector is computed once, the mask of the possible nodes is updated by the index of the selected node,
+    and the minimal distance of each node to the selected nodes is updated with a single np.minimum
+    with the distances to the selected node.
+    So each selection is O(n) instead of recomputing the probability vectors from scratch in O(n^2).
+    """
+
+    def __init__(self, features: np.ndarray, distance_matrix: np.ndarray = None, alpha: float = 3):
+        """
+        :param features: A NumPy array containing the score of each node (e.g. its capacity).
+        :param distance_matrix: A 2D NumPy array which is the distance between every two vertices in the graph
+                                (as created by get_distance_matrix). If it's None, the distances are not used.
+        :param alpha: The power to raise the features before dividing by the sum.
+        """
+        n = len(features)
+        self.features = features
+        self.distance_matrix = distance_matrix
+        self.alpha = alpha
+        self.possible_nodes_mask = np.ones(n, dtype=bool)
+        # The weight of each node is its minimal distance to a previously selected node,
+        # and all ones before selecting any node (since the distances are undefined).
+        self.min_distances = np.ones(n, dtype=np.float32)
+        self.selected_indices = list()
+
+    def get_probability_vector(self) -> np.ndarray:
+        """
+        :return: The probability vector to select the next node by.
+        """
+        p = features_to_probability_vector(self.features, self.possible_nodes_mask, self.alpha)
+
+        # Use distance factor between nodes and the the probability accordingly
+        if self.distance_matrix is not None:
+            distances_p = min_distances_to_probability_vector(self.min_distances)
+            combined_p = p * distances_p
+            p = combined_p / combined_p.sum()
+
+        return p
 
-def get_distance_matrix(graph, nodes):
+    def select(self, index: int):
+        """
+        Mark the node in the given index as selected.
+        """
+        self.possible_nodes_mask[index] = False
+        if self.distance_matrix is not None:
+            distances_to_selected = self.distance_matrix[:, index]
+            if len(self.selected_indices) == 0:
+                self.min_distances = hop_distances_to_float(distances_to_selected)
+            else:
+                np.minimum(self.min_distances, hop_distances_to_float(distances_to_selected), out=self.min_distances)
+        self.selected_indices.append(index)
+
+
+def get_distance_matrix(graph, nodes, workers: int = 1, memmap_path: str = None):
     """
     Get a distance matrix for the nodes in the graph.
 
@@ -163,18 +150,12 @@ def get_distance_matrix(graph, nodes):
     :param nodes: A list of the nodes in the graph.
                   This is important because we want the order of the nodes to be the same,
                   and calling graph.nodes does not necessarily maintain the order.
-    :return: A 2D NumPy array which is the distance between every two vertices in the graph.
+    :param workers: The number of worker processes to compute the distances with (1 means no worker processes).
+    :param memmap_path: If it's given, the matrix is written to a np.memmap in this path instead of residing in RAM.
+    :return: A 2D NumPy array of unsigned integers which is the (hop) distance between every two vertices in the graph.
+             Unreachable pairs have the maximal value of the type (see hop_distances.get_unreachable_value).
     """
-    n = len(nodes)
-    distance_matrix = np.full(shape=(n, n), fill_value=np.inf, dtype=np.float32)  # np.empty initializes with nans
-
-    for source_node, distances_to_targets in nx.shortest_path_length(graph):
-        i = nodes.index(source_node)
-        for target_node, distance in distances_to_targets.items():
-            j = nodes.index(target_node)
-            distance_matrix[i, j] = distance
-
-    return distance_matrix
+    return build_hop_distance_matrix(graph, nodes, workers, memmap_path)
 
 
 def visualize_current_step(graph, nodes, positions, agent_node, selected_node, selected_nodes, p, i, k):
@@ -206,7 +187,8 @@ def visualize_current_step(graph, nodes, positions, agent_node, selected_node, s
 
 
 def find_best_k_nodes(graph, k, agent_public_key, alpha=3, visualize=False, use_node_degree=False,
-                      use_node_routeness=False, use_node_distance=True, minimize=False):
+                      use_node_routeness=False, use_node_distance=True, minimize=False, routeness_workers=1,
+                      distance_workers=1, rng: np.random.Generator = None):
     """
     Find the best k nodes in the given graph,
     where 'best' means that they have high total capacities
@@ -218,35 +200,37 @@ def find_best_k_nodes(graph, k, agent_public_key, alpha=3, visualize=False, use_
     :param alpha: The power to raise to probability vector.
                   The higher it is, the differences between high values and small values gets larger.
     :param visualize: If it's true, visualize each step in the algorithm.
+    :param routeness_workers: The number of worker processes to compute the routeness with.
+    :param distance_workers: The number of worker processes to compute the distance matrix with.
+    :param rng: The random generator to sample the nodes with (by default a new one, seeded from the OS).
     :return: A list containing the k selected nodes.
     """
+    if rng is None:
+        rng = np.random.default_rng()
     nodes = [node for node in graph.nodes if node != agent_public_key]
     sub_graph = graph.subgraph(nodes).copy()
-    distance_matrix = get_distance_matrix(sub_graph, nodes)
+    distance_matrix = get_distance_matrix(sub_graph, nodes, distance_workers) if use_node_distance else None
 
-    positions = nx.spring_layout(graph)
+    # The layout is slow, so it's computed only for the visualization.
+    positions = get_graph_positions(graph) if visualize else None
 
+    # The features do not change between the iterations, so they are computed once.
+    if use_node_degree:
+        features = get_degrees_vector(sub_graph, nodes, minimize)
+    elif use_node_routeness:
+        features = get_routeness_vector(sub_graph, nodes, minimize, routeness_workers)
+    else:
+        features = get_capacities_vector(sub_graph, nodes, minimize)
+
+    selector = IncrementalNodesSelector(features, distance_matrix, alpha)
     selected_nodes = list()
 
     for i in range(k):
-        # Vector with 1's in the unselected nodes and 0's in the selcted nodes (for not choosing them again)
-        possible_nodes_mask = np.array([(node not in selected_nodes) for node in nodes])
-        if use_node_degree:
-            p_feature = get_degree_probability_vector(sub_graph, nodes, possible_nodes_mask, alpha, minimize)
-        elif use_node_routeness:
-            p_feature = get_routeness_probability_vector(sub_graph, nodes, possible_nodes_mask, alpha, minimize)
-        else:
-            p_feature = get_capacities_probability_vector(sub_graph, nodes, possible_nodes_mask, alpha, minimize)
-
-        # Use distance factor between nodes and the the probability accordingly
-        if use_node_distance:
-            distances_p = get_distances_probability_vector(possible_nodes_mask, distance_matrix)
-            combined_p = p_feature * distances_p
-            p = combined_p / combined_p.sum()
-        else:
-            p = p_feature
+        p = selector.get_probability_vector()
 
-        selected_node = np.random.choice(nodes, p=p)
+        selected_index = rng.choice(len(nodes), p=p)
+        selector.select(selected_index)
+        selected_node = nodes[selected_index]
         selected_nodes.append(selected_node)
 
         if visualize:
@@ -258,8 +242,11 @@ def find_best_k_nodes(graph, k, agent_public_key, alpha=3, visualize=False, use_
 class LightningPlusPlusAgent(AbstractAgent):
     def __init__(self, public_key, initial_funds, channel_cost,
                  alpha=3, n_channels_per_node=2, desired_num_edges=10, minimize=False, use_node_degree=False,
-                 use_node_routeness=False, use_nodes_distance=True, fee: int = None):
-        super(LightningPlusPlusAgent, self).__init__(public_key, initial_funds, channel_cost)
+                 use_node_routeness=False, use_nodes_distance=True, fee: int = None, routeness_workers: int = 1,
+                 rng: np.random.Generator = None):
+        super(LightningPlusPlusAgent, self).__init__(public_key, initial_funds, channel_cost, rng)
+
+        self.routeness_workers = routeness_workers
 
         self.fee = fee
         self.alpha = alpha
@@ -292,7 +279,8 @@ class LightningPlusPlusAgent(AbstractAgent):
                                               agent_public_key=self.pub_key, alpha=self.alpha, visualize=False,
                                               use_node_degree=self.use_node_degree,
                                               use_node_routeness=self.use_node_routeness,
-                                              use_node_distance=self.use_nodes_distance, minimize=self.minimize)
+                                              use_node_distance=self.use_nodes_distance, minimize=self.minimize,
+                                              routeness_workers=self.routeness_workers, rng=self.rng)
 
         nodes_in_already_chosen_edges = set()
 
@@ -303,7 +291,7 @@ class LightningPlusPlusAgent(AbstractAgent):
             else:
                 node_neighbors = [n for n in graph.neighbors(node) if n not in nodes_in_already_chosen_edges]
                 if len(node_neighbors) > self.n_channels_per_node:
-                    nodes_to_connect_with = random.sample(node_neighbors, k=self.n_channels_per_node)
+                    nodes_to_connect_with = self.sample_nodes(node_neighbors, k=self.n_channels_per_node)
                 else:
                     nodes_to_connect_with = node_neighbors
 
@@ -1,12 +1,14 @@
-import random
+import numpy as np
+
 from Agents.AbstractAgent import AbstractAgent
 from utils.common import LND_DEFAULT_POLICY
 import networkx as nx
 
 
 class RandomInvestor(AbstractAgent):
-    def __init__(self, public_key: str, initial_funds: int, channel_cost: int, desired_num_edges=10):
-        super(RandomInvestor, self).__init__(public_key, initial_funds, channel_cost)
+    def __init__(self, public_key: str, initial_funds: int, channel_cost: int, desired_num_edges=10,
+                 rng: np.random.Generator = None):
+        super(RandomInvestor, self).__init__(public_key, initial_funds, channel_cost, rng)
         self.desired_num_edges = desired_num_edges
         self.default_balance_amount = initial_funds / self.desired_num_edges
 
@@ -24,7 +26,7 @@ class RandomInvestor(AbstractAgent):
         channels = list()
         while possible_nodes != [] and funds_to_spend >= self.channel_cost:
             # Choose random public_key for connection
-            random_node_pub_key = random.choice(possible_nodes)
+            random_node_pub_key = possible_nodes[self.rng.integers(len(possible_nodes))]
             possible_nodes.remove(random_node_pub_key)
             # Randomize the balances
             chanel_balance = min(self.default_balance_amount, funds_to_spend - self.channel_cost)
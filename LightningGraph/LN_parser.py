@@ -1,30 +1,35 @@
 import json
-import random
 import networkx as nx
-from LightningGraph.lightning_implementation_inference import infer_node_implementation
+import numpy as np
+from LightningGraph.lightning_implementation_inference import infer_nodes_implementations
 
 
-def _compute_total_node_capacity(graph, node):
+def compute_total_nodes_capacities(n_nodes: int, nodes1: np.ndarray, nodes2: np.ndarray,
+                                   capacities: np.ndarray) -> np.ndarray:
     """
-    Sum the capacities in all edges touching a given node
+    Sum the capacities in all edges touching each node (a self-loop is counted once).
+
+    :param n_nodes: The number of nodes.
+    :param nodes1: The index of the first node of each edge.
+    :param nodes2: The index of the second node of each edge.
+    :param capacities: The capacity of each edge.
+    :return: The total capacity of each node (as integers).
     """
-    neighbours = graph.adj[node]._atlas
-    return sum([neighbours[adj_node_id][channel_id]['capacity']
-                for adj_node_id in neighbours for channel_id in neighbours[adj_node_id]])
+    # The weighted bincount sums in float64, which is exact for any sum of satoshis (below 2 ** 53).
+    return (np.bincount(nodes1, weights=capacities, minlength=n_nodes) +
+            np.bincount(nodes2, weights=np.where(nodes1 != nodes2, capacities, 0), minlength=n_nodes)).astype(np.int64)
 
 
-def _filter_nonvalid_data(json_data):
+def _is_valid_channel(channel):
     """
-    Remove channels that are disabled or that do not declare their policies.
+    :return: False for channels that are disabled or that do not declare their policies.
     """
     # Filter to channels having both peers exposing their policies
-    json_data['edges'] = list(filter(lambda x: x['node1_policy'] and x['node2_policy'], json_data['edges']))
+    if not (channel['node1_policy'] and channel['node2_policy']):
+        return False
 
     # Filter to non disabled channels
-    json_data['edges'] = list(filter(lambda x: not (x['node1_policy']['disabled'] or x['node2_policy']['disabled']),
-                                     json_data['edges']))
-
-    return json_data
+    return not (channel['node1_policy']['disabled'] or channel['node2_policy']['disabled'])
 
 
 def cast_channel_data(channel):
@@ -45,17 +50,148 @@ def cast_channel_data(channel):
             channel[policy_key]['proportional_fee'] = float(channel[policy_key]['fee_rate_milli_msat']) / 1000
 
 
+# The size of the chunks the dumps are read in.
+JSON_CHUNK_SIZE = 2 ** 20
+# The characters that may follow a complete JSON value.
+JSON_DELIMITERS = frozenset(',:]} \t\n\r')
+
+
+class _JsonStream:
+    """
+    A cursor over a JSON text file, which is read in chunks as it's consumed
+    (the part of the text that was consumed is dropped when the next chunk is read).
+    """
+
+    def __init__(self, json_file, chunk_size: int = JSON_CHUNK_SIZE):
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _read_chunk(self) -> bool:
+        """
+        :return: False if the file ended (so nothing was read).
+        """
+        chunk = '' if self.eof else self.json_file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip the whitespaces.
+        :return: The next character (or '' if the file ended).
+        """
+        while True:
+            self.position = json.decoder.WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read_chunk():
+                return ''
+
+    def consume(self, expected_characters: str) -> str:
+        """
+        Consume the next character, which must be one of the given characters.
+        :return: The consumed character.
+        """
+        character = self.peek()
+        if character == '' or character not in expected_characters:
+            raise json.JSONDecodeError(f"Expecting one of '{expected_characters}'", self.buffer, self.position)
+        self.position += 1
+        return character
+
+    def decode(self):
+        """
+        :return: The next JSON value (reading more chunks if it's incomplete).
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self._read_chunk():
+                    continue
+                raise
+
+            # A number (or any scalar) is decoded from the prefix of it that is in the buffer (e.g. "12." as 12),
+            # so it's complete only if it's followed by a delimiter. Otherwise it might continue in the next chunk.
+            is_scalar = not isinstance(value, (str, list, dict))
+            if (end == len(self.buffer) or (is_scalar and self.buffer[end] not in JSON_DELIMITERS)) and \
+                    self._read_chunk():
+                continue
+            self.position = end
+            return value
+
+
+def iterate_json_arrays(json_file, chunk_size: int = JSON_CHUNK_SIZE):
+    """
+    Iterate over the items of the arrays in a JSON object of arrays (like the dumps, {"nodes": [...], "edges": [...]}),
+    decoding a single item at a time. Since the file is read in chunks, the memory does not depend on its size.
+    Values of the object which are not arrays are skipped.
+
+    :param json_file: A JSON text file.
+    :param chunk_size: The size of the chunks the file is read in.
+    :return: An iterator over tuples of the key of an array and an item in it, in the order of the file.
+    """
+    stream = _JsonStream(json_file, chunk_size)
+    stream.consume('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        key = stream.decode()
+        stream.consume(':')
+        if stream.peek() == '[':
+            stream.consume('[')
+            if stream.peek() == ']':
+                stream.consume(']')
+            else:
+                # Each item is followed by a ',' or by the end of the array.
+                while True:
+                    yield key, stream.decode()
+                    if stream.consume(',]') == ']':
+                        break
+        else:
+            stream.decode()
+
+        if stream.consume(',}') == '}':
+            return
+
+
+def read_dump(json_path):
+    """
+    Read the JSON file created by LND describegraph command on the mainnet.
+    The file is decoded incrementally, dropping the invalid channels and the unused attributes of the nodes
+    on the fly, so the memory is proportional to the resulting channels rather than to the file.
+
+    :return: The list of the public keys of the nodes and the list of the valid channels (with their values cast)
+             in the dump.
+    """
+    node_pub_keys = list()
+    channels = list()
+    with open(json_path, 'r', encoding="utf8") as json_file:
+        for key, item in iterate_json_arrays(json_file):
+            if key == 'nodes':
+                node_pub_keys.append(item.get('pub_key'))
+            elif key == 'edges' and _is_valid_channel(item):
+                cast_channel_data(item)
+                channels.append(item)
+
+    return node_pub_keys, channels
+
+
 def read_data_to_xgraph(json_path):
     """Create an undirected multigraph using networkx and load the data to it"""
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = json.load(open(json_path, 'r', encoding="utf8"))
-    json_data = _filter_nonvalid_data(json_data)
+    node_pub_keys, channels = read_dump(json_path)
     graph = nx.MultiGraph()
-    for i, node_data in enumerate(json_data['nodes']):
-        pub_key = node_data.pop('pub_key', None)
+    for i, pub_key in enumerate(node_pub_keys):
         graph.add_node(pub_key, pub_key=pub_key, serial_number=i)
-    for edge_data in json_data['edges']:
-        cast_channel_data(edge_data)
+    for edge_data in channels:
         graph.add_edge(edge_data['node1_pub'], edge_data['node2_pub'], edge_data['channel_id'], **edge_data)
     
     return graph
@@ -65,7 +201,8 @@ def process_lightning_graph(graph,
                             remove_isolated=False,
                             total_capacity=False,
                             infer_implementation=False,
-                            add_dummy_balances=True):
+                            add_dummy_balances=True,
+                            rng: np.random.Generator = None):
     """
     Analyze graph and add additional attributes.
 
@@ -80,24 +217,36 @@ def process_lightning_graph(graph,
                                  involving the default values of their policies.
     :param add_dummy_balances: If True, assign dummy balances for each node in each channel,
                                by distributing the channel capacity randomly between the two nodes.
+    :param rng: The random generator of the dummy balances (by default a new one, seeded from the OS).
     """
     if remove_isolated:
         graph.remove_nodes_from(list(nx.isolates(graph)))
 
+    # A single pass over the edges, the rest of the processing is done on arrays.
+    edges_data = [data for _, _, data in graph.edges(data=True)]
+    capacities = np.array([data['capacity'] for data in edges_data], dtype=np.int64)
+
     # Sets node's total capacity (sum of the capacities on its adjacent edges)
     if total_capacity:
-        for node in graph.nodes:
-            graph.nodes[node]['total_capacity'] = _compute_total_node_capacity(graph, node)
+        node_index = {node: i for i, node in enumerate(graph.nodes)}
+        nodes1, nodes2 = np.array([(node_index[node1], node_index[node2]) for node1, node2 in graph.edges()],
+                                  dtype=np.int64).reshape(-1, 2).T
+        total_capacities = compute_total_nodes_capacities(len(node_index), nodes1, nodes2, capacities)
+        for node, node_total_capacity in zip(graph.nodes, total_capacities.tolist()):
+            graph.nodes[node]['total_capacity'] = node_total_capacity
 
     # Set's node routing implementation names
     if infer_implementation:
-        for node in graph.nodes:
-            graph.nodes[node]['routing_implementation'] = infer_node_implementation(node, graph.adj[node]._atlas)
+        for node, implementation in infer_nodes_implementations(graph).items():
+            graph.nodes[node]['routing_implementation'] = implementation
 
     if add_dummy_balances:
-        for edge in graph.edges:
-            capacity = graph.edges[edge]['capacity']
-            node1_balance_ratio = random.random()
-            node2_balance_ratio = 1 - node1_balance_ratio
-            graph.edges[edge]['node1_balance'] = node1_balance_ratio * capacity
-            graph.edges[edge]['node2_balance'] = node2_balance_ratio * capacity
+        if rng is None:
+            rng = np.random.default_rng()
+        # The ratios are the same as drawing them edge by edge (in the order of the edges).
+        node1_balance_ratios = rng.random(len(edges_data))
+        node1_balances = (node1_balance_ratios * capacities).tolist()
+        node2_balances = ((1 - node1_balance_ratios) * capacities).tolist()
+        for data, node1_balance, node2_balance in zip(edges_data, node1_balances, node2_balances):
+            data['node1_balance'] = node1_balance
+            data['node2_balance'] = node2_balance
@@ -0,0 +1,335 @@
+import copy
+from collections import ChainMap
+from typing import List, Dict, NamedTuple
+
+import networkx as nx
+import numpy as np
+
+
+class PricedRoute(NamedTuple):
+    """
+    A route in a compiled graph together with the amount each of its slots transfers (including the fees),
+    which are fixed for a fixed amount that should reach the target. So transferring it again does not
+    have to calculate the fees again.
+    """
+    # The slots of the route, ordered from the source to the target.
+    slots: np.ndarray
+    # The slots and the amounts as plain lists, since it's faster to iterate a few Python numbers than NumPy arrays.
+    slots_list: List[int]
+    amounts_list: List[float]
+    # The nodes of the route (from the source to the target) and the change in the balance of each of them
+    # when the route is transferred.
+    nodes_list: List[int]
+    node_deltas_list: List[float]
+
+
+# The arrays of CompiledChannelGraph with an entry per slot.
+SLOT_ARRAYS = ['slot_sender', 'slot_receiver', 'base_fee', 'proportional_fee', 'time_lock_delta', 'balance']
+
+
+class CompiledChannelGraph:
+    """
+    An array-backed snapshot of a lightning graph, used by the hot paths of the simulator (routing and transfers).
+
+    The nodes are mapped to integers 0, ..., n-1 (in the order of graph.nodes).
+    Each channel c is split into two directed half-channels, called 'slots':
+        slot 2*c   is the direction node1 --> node2 of the channel,
+        slot 2*c+1 is the direction node2 --> node1 of the channel.
+    So the reversed direction of a slot s is always s ^ 1.
+    All of the per-slot arrays describe the sender of the slot - its policy and its balance in the channel.
+
+    The topology and the policies are frozen at construction time, only the balances change afterwards
+    (use sync_balances_to_graph to write them back to the networkx graph, e.g. for plotting).
+    Therefore copies of the compiled graph share everything but the balances (see copy and with_channels).
+    """
+
+    def __init__(self, graph: nx.MultiGraph):
+        """
+        :param graph: The lightning graph to compile, as created by LN_parser.read_data_to_xgraph
+                      and processed by LN_parser.process_lightning_graph (so it has balances).
+        """
+        node_ids = list(graph.nodes)
+        edge_keys = list(graph.edges(keys=True))
+        channels = [graph.edges[edge_key] for edge_key in edge_keys]
+        node_index = {node: i for i, node in enumerate(node_ids)}
+        self._init_from_arrays(node_ids, edge_keys, [channel['channel_id'] for channel in channels],
+                               self._compile_channels(channels, node_index))
+
+    @classmethod
+    def from_arrays(cls, node_ids: List, edge_keys: List, channel_ids: List,
+                    arrays: Dict[str, np.ndarray]) -> 'CompiledChannelGraph':
+        """
+        Create a compiled graph directly from the arrays of its channels, without a networkx graph
+        (e.g. from a LightningGraph.graph_snapshot.GraphSnapshot).
+
+        :param node_ids: The public keys of the nodes (their order defines their indices).
+        :param edge_keys: The (u, v, key) tuples of the channels in the networkx graph (if it's materialized).
+        :param channel_ids: The ids of the channels.
+        :param arrays: A dictionary mapping the name of each of the arrays in SLOT_ARRAYS (and 'capacity')
+                       to its values, like the one returned by _compile_channels.
+        :return: The compiled graph.
+        """
+        compiled_graph = cls.__new__(cls)
+        compiled_graph._init_from_arrays(node_ids, edge_keys, channel_ids, arrays)
+        return compiled_graph
+
+    def _init_from_arrays(self, node_ids: List, edge_keys: List, channel_ids: List, arrays: Dict[str, np.ndarray]):
+        self.node_ids: List = node_ids
+        self.node_index = {node: i for i, node in enumerate(self.node_ids)}
+        n_nodes = len(self.node_ids)
+
+        # The (u, v, key) tuples of the channels in the networkx graph, needed to write the balances back.
+        self.edge_keys: List = edge_keys
+        self.channel_ids: List = channel_ids
+        self.channel_index = {channel_id: c for c, channel_id in enumerate(self.channel_ids)}
+
+        self.slot_sender: np.ndarray = arrays['slot_sender']
+        self.slot_receiver: np.ndarray = arrays['slot_receiver']
+        self.base_fee: np.ndarray = arrays['base_fee']
+        self.proportional_fee: np.ndarray = arrays['proportional_fee']
+        self.time_lock_delta: np.ndarray = arrays['time_lock_delta']
+        self.balance: np.ndarray = arrays['balance']
+        self.capacity: np.ndarray = arrays['capacity']
+        # The sum of the balances of each node in all of its channels, maintained by the transfers.
+        self.node_balance = np.bincount(self.slot_sender, weights=self.balance, minlength=n_nodes)
+
+        # CSR adjacency of the half-channels, grouped by their receiver (for the backwards Dijkstra of the routing)
+        # and by their sender (for summing the balance of a node).
+        self.in_indptr, self.in_slots = self._group_slots_by(self.slot_receiver, n_nodes)
+        self.out_indptr, self.out_slots = self._group_slots_by(self.slot_sender, n_nodes)
+
+    @staticmethod
+    def _compile_channels(channels: List[Dict], node_index: Dict) -> Dict[str, np.ndarray]:
+        """
+        :param channels: A list of channels, each is a dictionary of the channel's attributes
+                         (like the edges data of the graph).
+        :param node_index: The mapping of the nodes to their indices.
+        :return: A dictionary mapping the name of each of the arrays in SLOT_ARRAYS (and 'capacity')
+                 to its values for the given channels, where channel c has the slots 2*c and 2*c+1.
+        """
+        n_slots = 2 * len(channels)
+        arrays = {name: np.empty(n_slots, dtype=np.int64 if name.startswith('slot_') else np.float64)
+                  for name in SLOT_ARRAYS}
+        arrays['capacity'] = np.empty(len(channels), dtype=np.float64)
+
+        for c, channel in enumerate(channels):
+            arrays['capacity'][c] = channel['capacity']
+
+            for direction, (sender_i, receiver_i) in enumerate([(1, 2), (2, 1)]):
+                slot = 2 * c + direction
+                policy = channel[f'node{sender_i}_policy']
+                arrays['slot_sender'][slot] = node_index[channel[f'node{sender_i}_pub']]
+                arrays['slot_receiver'][slot] = node_index[channel[f'node{receiver_i}_pub']]
+                arrays['base_fee'][slot] = policy['fee_base_msat']
+                arrays['proportional_fee'][slot] = policy['proportional_fee']
+                arrays['time_lock_delta'][slot] = policy['time_lock_delta']
+                arrays['balance'][slot] = channel[f'node{sender_i}_balance']
+
+        return arrays
+
+    @staticmethod
+    def _insert_slots(indptr: np.ndarray, slots: np.ndarray, new_slots: np.ndarray, new_slot_nodes: np.ndarray):
+        """
+        Insert slots to a CSR structure created by _group_slots_by,
+        without sorting the existing slots again.
+
+        :param indptr: The indptr of the CSR structure.
+        :param slots: The slots of the CSR structure.
+        :param new_slots: The slots to insert (which are larger than all of the existing slots).
+        :param new_slot_nodes: An array containing for each of the new slots the node it should be grouped by.
+        :return: A tuple (indptr, slots) of the new CSR structure, which is identical to grouping all of the slots
+                 with _group_slots_by.
+        """
+        order = np.argsort(new_slot_nodes, kind='stable')
+        new_slots, new_slot_nodes = new_slots[order], new_slot_nodes[order]
+
+        # The new slots of a node are placed after its existing slots.
+        new_slots_counts = np.bincount(new_slot_nodes, minlength=len(indptr) - 1)
+        new_indptr = indptr.copy()
+        new_indptr[1:] += np.cumsum(new_slots_counts)
+        return new_indptr, np.insert(slots, indptr[new_slot_nodes + 1], new_slots)
+
+    @staticmethod
+    def _group_slots_by(slot_nodes: np.ndarray, n_nodes: int):
+        """
+        Build a CSR structure grouping the slots by the given per-slot node array.
+
+        :param slot_nodes: An array containing for each slot the node it should be grouped by.
+        :param n_nodes: The number of nodes in the graph.
+        :return: A tuple (indptr, slots), where the slots of node i are slots[indptr[i]:indptr[i+1]].
+        """
+        slots = np.argsort(slot_nodes, kind='stable')
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(slot_nodes, minlength=n_nodes), out=indptr[1:])
+        return indptr, slots
+
+    def copy(self) -> 'CompiledChannelGraph':
+        """
+        :return: A copy of the compiled graph which has its own balances,
+                 but shares the (immutable) topology and policies with this compiled graph.
+        """
+        compiled_graph = copy.copy(self)
+        compiled_graph.balance = self.balance.copy()
+        compiled_graph.node_balance = self.node_balance.copy()
+        return compiled_graph
+
+    def with_channels(self, channels: List[Dict]) -> 'CompiledChannelGraph':
+        """
+        Create a copy of the compiled graph with additional channels (between nodes that already exist),
+        e.g. the channels of an agent.
+        The arrays are extended by concatenating the slots of the new channels after the existing slots,
+        so the existing channels keep their slots.
+
+        :param channels: A list of channels, each is a dictionary of the channel's attributes
+                         (like the edges data of the graph).
+        :return: The new compiled graph.
+        """
+        compiled_graph = copy.copy(self)
+        first_new_slot = len(self.slot_sender)
+
+        compiled_graph.edge_keys = self.edge_keys + [(channel['node1_pub'], channel['node2_pub'], channel['channel_id'])
+                                                     for channel in channels]
+        compiled_graph.channel_ids = self.channel_ids + [channel['channel_id'] for channel in channels]
+        compiled_graph.channel_index = ChainMap({channel['channel_id']: first_new_slot // 2 + i
+                                                 for i, channel in enumerate(channels)}, self.channel_index)
+
+        new_arrays = self._compile_channels(channels, self.node_index)
+        for name, new_array in new_arrays.items():
+            setattr(compiled_graph, name, np.concatenate([getattr(self, name), new_array]))
+
+        compiled_graph.node_balance = self.node_balance + np.bincount(
+            new_arrays['slot_sender'], weights=new_arrays['balance'], minlength=self.n_nodes)
+
+        new_slots = np.arange(first_new_slot, first_new_slot + 2 * len(channels))
+        compiled_graph.in_indptr, compiled_graph.in_slots = self._insert_slots(
+            self.in_indptr, self.in_slots, new_slots, new_arrays['slot_receiver'])
+        compiled_graph.out_indptr, compiled_graph.out_slots = self._insert_slots(
+            self.out_indptr, self.out_slots, new_slots, new_arrays['slot_sender'])
+
+        return compiled_graph
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def incoming_slots(self, node: int) -> np.ndarray:
+        """
+        :param node: The index of a node.
+        :return: The half-channels transferring money to the given node.
+        """
+        return self.in_slots[self.in_indptr[node]:self.in_indptr[node + 1]]
+
+    def outgoing_slots(self, node: int) -> np.ndarray:
+        """
+        :param node: The index of a node.
+        :return: The half-channels transferring money from the given node.
+        """
+        return self.out_slots[self.out_indptr[node]:self.out_indptr[node + 1]]
+
+    def route_to_slots(self, route: List) -> np.ndarray:
+        """
+        :param route: List of edges (tuples of 3: 2 nodes and the channel id), ordered from the source to the target.
+        :return: The corresponding array of slots.
+        """
+        slots = np.empty(len(route), dtype=np.int64)
+        for i, (src, _, channel_id) in enumerate(route):
+            c = self.channel_index[channel_id]
+            slots[i] = 2 * c if self.slot_sender[2 * c] == self.node_index[src] else 2 * c + 1
+        return slots
+
+    def slots_to_route(self, slots) -> List:
+        """
+        :param slots: An array of slots, ordered from the source to the target.
+        :return: The corresponding list of edges (tuples of 3: 2 nodes and the channel id),
+                 in the same format returned by routing.LND_routing.get_route.
+        """
+        return [(self.node_ids[self.slot_sender[slot]],
+                 self.node_ids[self.slot_receiver[slot]],
+                 self.channel_ids[slot >> 1]) for slot in slots]
+
+    def get_route_amounts(self, slots: np.ndarray, amount: int) -> np.ndarray:
+        """
+        Calculate the amount each sender in the route transfers, including the fees of the route.
+        This is the array-backed equivalent of the amounts used in LightningSimulator.transfer_money_in_graph
+        (i.e. amount + reversed cumulative sum of utils.common.calculate_route_fees).
+
+        :param slots: An array of slots, ordered from the source to the target.
+        :param amount: The amount of money that should reach the target.
+        :return: An array with the amount each slot in the route transfers.
+        """
+        fees = np.empty(len(slots), dtype=np.float64)
+        total_amount = amount
+
+        # Traverse the reversed route from the target to the source and sum the fee in each step.
+        for i in range(len(slots) - 1, -1, -1):
+            slot = slots[i]
+            fee = self.base_fee[slot] + int(total_amount * self.proportional_fee[slot])
+            fees[i] = fee
+            total_amount += fee
+
+        return amount + np.cumsum(fees)[::-1]
+
+    def price_route(self, slots: np.ndarray, amount: int) -> PricedRoute:
+        """
+        :param slots: An array of slots, ordered from the source to the target.
+        :param amount: The amount of money that should reach the target.
+        :return: The route together with the amount each of its slots transfers.
+        """
+        amounts = self.get_route_amounts(slots, amount)
+        nodes = np.append(self.slot_sender[slots], self.slot_receiver[slots[-1]])
+        # Each node pays the amount of its slot and gets the amount of the previous slot.
+        node_deltas = np.append(0, amounts) - np.append(amounts, 0)
+        return PricedRoute(slots, slots.tolist(), amounts.tolist(), nodes.tolist(), node_deltas.tolist())
+
+    def transfer(self, slots: np.ndarray, amount: int) -> int:
+        """
+        Perform transfer of money along a route, changing the balances of the channels accordingly.
+
+        :param slots: An array of slots, ordered from the source to the target.
+        :param amount: Amount to transfer.
+        :return: int: len(slots) if transaction succeeded
+                      Otherwise, it returns the index of the first slot that wasn't able to transfer the funds.
+        """
+        return self.transfer_priced_route(self.price_route(slots, amount))
+
+    def transfer_priced_route(self, route: PricedRoute) -> int:
+        """
+        Perform transfer of money along a priced route, changing the balances of the channels accordingly.
+
+        :param route: The priced route.
+        :return: int: len(route.slots) if transaction succeeded
+                      Otherwise, it returns the index of the first slot that wasn't able to transfer the funds.
+        """
+        balance = self.balance
+        for i, (slot, amount) in enumerate(zip(route.slots_list, route.amounts_list)):
+            if balance[slot] < amount:
+                return i
+
+        for slot, amount in zip(route.slots_list, route.amounts_list):
+            balance[slot] -= amount
+            balance[slot ^ 1] += amount
+
+        node_balance = self.node_balance
+        for node, node_delta in zip(route.nodes_list, route.node_deltas_list):
+            node_balance[node] += node_delta
+
+        return len(route.slots_list)
+
+    def get_node_balance(self, node: int) -> float:
+        """
+        :param node: The index of a node.
+        :return: Sums the balances of the node from all his channels (which is maintained by the transfers, so O(1)).
+        """
+        return self.node_balance[node]
+
+    def sync_balances_to_graph(self, graph: nx.MultiGraph):
+        """
+        Write the current balances back to the 'node1_balance' and 'node2_balance' attributes
+        of the networkx graph this was compiled from.
+
+        :param graph: The graph to update.
+        """
+        for c, edge_key in enumerate(self.edge_keys):
+            edge_data = graph.edges[edge_key]
+            edge_data['node1_balance'] = float(self.balance[2 * c])
+            edge_data['node2_balance'] = float(self.balance[2 * c + 1])
@@ -0,0 +1,195 @@
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import networkx as nx
+import numpy as np
+
+from LightningGraph.LN_parser import read_dump
+from LightningGraph.compiled_graph import CompiledChannelGraph
+from utils.caching import file_hash
+
+# The attributes of the channels and of their policies which are kept in a snapshot, with their types
+# (after LN_parser.cast_channel_data). The other attributes of the dump are not used, so they are dropped.
+# An attribute which is missing in some of the channels of the dump is dropped as well.
+CHANNEL_FIELDS = {'channel_id': str, 'chan_point': str, 'last_update': np.int64, 'capacity': np.int64}
+POLICY_FIELDS = {'time_lock_delta': np.int64, 'min_htlc': np.float64, 'fee_base_msat': np.float64,
+                 'fee_rate_milli_msat': np.float64, 'proportional_fee': np.float64, 'disabled': np.bool_,
+                 'max_htlc_msat': str, 'last_update': np.int64}
+
+# Part of the file names of the snapshots, so changing the format does not load old snapshots.
+SNAPSHOT_VERSION = 1
+
+
+class GraphSnapshot:
+    """
+    The nodes and the channels of a lightning graph dump (as read by LN_parser.read_dump)
+    as a set of NumPy arrays, which are saved to (and loaded from) a single .npz file:
+        'node_pub_keys'        - the string table of the public keys of the nodes (their order defines their indices),
+        'node_serial_numbers'  - the serial number of each node in the dump (-1 for nodes which only appear in channels),
+        'channel_nodes'        - the indices of node1 and node2 of each channel (an array of shape (n_channels, 2)),
+        'channels.<field>'     - a column for each of the CHANNEL_FIELDS,
+        'node<i>_policy.<field>' - a column for each of the POLICY_FIELDS of the policy of node<i> in each channel.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.arrays['node_pub_keys'])
+
+    @property
+    def n_channels(self) -> int:
+        return len(self.arrays['channel_nodes'])
+
+    @classmethod
+    def from_dump(cls, node_pub_keys: List[str], channels: List[Dict]) -> 'GraphSnapshot':
+        """
+        :param node_pub_keys: The public keys of the nodes of the dump.
+        :param channels: The valid channels of the dump, as returned by LN_parser.read_dump.
+        :return: The snapshot of the dump.
+        """
+        node_index = dict()
+        for pub_key in node_pub_keys:
+            node_index.setdefault(pub_key, len(node_index))
+        node_serial_numbers = list(range(len(node_index)))
+        for channel in channels:
+            for pub_key in [channel['node1_pub'], channel['node2_pub']]:
+                if pub_key not in node_index:
+                    node_index[pub_key] = len(node_index)
+                    node_serial_numbers.append(-1)
+
+        arrays = {
+            'node_pub_keys': np.array(list(node_index), dtype=str),
+            'node_serial_numbers': np.array(node_serial_numbers, dtype=np.int64),
+            'channel_nodes': np.array([(node_index[channel['node1_pub']], node_index[channel['node2_pub']])
+                                       for channel in channels], dtype=np.int64).reshape(-1, 2),
+        }
+        columns = [('channels', field, dtype, [channel.get(field) for channel in channels])
+                   for field, dtype in CHANNEL_FIELDS.items()]
+        columns += [(f'node{i}_policy', field, dtype, [channel[f'node{i}_policy'].get(field) for channel in channels])
+                    for i in [1, 2] for field, dtype in POLICY_FIELDS.items()]
+        for prefix, field, dtype, values in columns:
+            if not any(value is None for value in values):
+                arrays[f'{prefix}.{field}'] = np.array(values, dtype=dtype)
+
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'GraphSnapshot':
+        with np.load(path) as snapshot_file:
+            return cls({name: snapshot_file[name] for name in snapshot_file.files})
+
+    def save(self, path: str):
+        """
+        Save the snapshot to the given .npz path.
+        The snapshot is written to a temporary file which is then renamed,
+        so concurrent readers never see a partially written file.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **self.arrays)
+        os.replace(temp_path, path)
+
+    def _get_rows(self, prefix: str) -> Tuple[List[str], Iterator[Tuple]]:
+        """
+        :return: The names of the fields of the columns with the given prefix, and an iterator over their rows.
+        """
+        names = [name for name in self.arrays if name.startswith(f'{prefix}.')]
+        return [name[len(prefix) + 1:] for name in names], zip(*[self.arrays[name].tolist() for name in names])
+
+    def to_xgraph(self) -> nx.MultiGraph:
+        """
+        :return: The networkx graph of the snapshot, identical to the one read_data_to_xgraph creates from the dump.
+        """
+        node_pub_keys = self.arrays['node_pub_keys'].tolist()
+        graph = nx.MultiGraph()
+        # The adjacency of the graph is filled directly (in the same order add_edge would fill it),
+        # since add_edges_from is much slower than creating the attributes of the channels.
+        nodes, adjacency = graph._node, graph._adj
+        for pub_key, serial_number in zip(node_pub_keys, self.arrays['node_serial_numbers'].tolist()):
+            nodes[pub_key] = {'pub_key': pub_key, 'serial_number': serial_number} if serial_number >= 0 else {}
+            adjacency[pub_key] = {}
+
+        channel_fields, channel_rows = self._get_rows('channels')
+        policy1_fields, policy1_rows = self._get_rows('node1_policy')
+        policy2_fields, policy2_rows = self._get_rows('node2_policy')
+        for (node1, node2), channel_row, policy1_row, policy2_row in zip(self.arrays['channel_nodes'].tolist(),
+                                                                        channel_rows, policy1_rows, policy2_rows):
+            channel = dict(zip(channel_fields, channel_row))
+            node1_pub, node2_pub = node_pub_keys[node1], node_pub_keys[node2]
+            channel['node1_pub'] = node1_pub
+            channel['node2_pub'] = node2_pub
+            channel['node1_policy'] = dict(zip(policy1_fields, policy1_row))
+            channel['node2_policy'] = dict(zip(policy2_fields, policy2_row))
+
+            # Both directions of the adjacency share the same dictionary of the parallel channels.
+            parallel_channels = adjacency[node1_pub].get(node2_pub)
+            if parallel_channels is None:
+                parallel_channels = adjacency[node1_pub][node2_pub] = adjacency[node2_pub][node1_pub] = {}
+            parallel_channels[channel['channel_id']] = channel
+
+        return graph
+
+    def to_compiled_graph(self, node1_balances: np.ndarray) -> CompiledChannelGraph:
+        """
+        Create the array graph of the snapshot directly, without materializing a networkx graph.
+
+        :param node1_balances: The balance of node1 in each channel (node2 gets the rest of the capacity).
+        :return: The compiled graph.
+        """
+        def interleave(node1_values, node2_values) -> np.ndarray:
+            # Channel c has the slots 2*c (node1 --> node2) and 2*c+1 (node2 --> node1).
+            return np.column_stack([node1_values, node2_values]).ravel()
+
+        def interleave_policies(field) -> np.ndarray:
+            return interleave(self.arrays[f'node1_policy.{field}'],
+                              self.arrays[f'node2_policy.{field}']).astype(np.float64)
+
+        channel_nodes = self.arrays['channel_nodes']
+        capacity = self.arrays['channels.capacity'].astype(np.float64)
+        arrays = {
+            'slot_sender': channel_nodes.ravel(),
+            'slot_receiver': channel_nodes[:, ::-1].ravel(),
+            'base_fee': interleave_policies('fee_base_msat'),
+            'proportional_fee': interleave_policies('proportional_fee'),
+            'time_lock_delta': interleave_policies('time_lock_delta'),
+            'balance': interleave(node1_balances, capacity - node1_balances).astype(np.float64),
+            'capacity': capacity,
+        }
+
+        node_pub_keys = self.arrays['node_pub_keys'].tolist()
+        channel_ids = self.arrays['channels.channel_id'].tolist()
+        edge_keys = [(node_pub_keys[node1], node_pub_keys[node2], channel_id)
+                     for (node1, node2), channel_id in zip(channel_nodes.tolist(), channel_ids)]
+        return CompiledChannelGraph.from_arrays(node_pub_keys, edge_keys, channel_ids, arrays)
+
+
+def get_snapshot_path(json_path: str, snapshot_dir: str = None) -> str:
+    """
+    :param json_path: The path of a JSON dump.
+    :param snapshot_dir: The directory of the snapshots. By default it's the directory of the dump.
+    :return: The path of the snapshot of the dump, which is keyed by the hash of the dump's contents.
+    """
+    if snapshot_dir is None:
+        snapshot_dir = os.path.dirname(json_path)
+    dump_name = os.path.splitext(os.path.basename(json_path))[0]
+    return os.path.join(snapshot_dir, f'{dump_name}-{file_hash(json_path)}-v{SNAPSHOT_VERSION}.npz')
+
+
+def load_graph_snapshot(json_path: str, snapshot_dir: str = None) -> GraphSnapshot:
+    """
+    Load the snapshot of the given JSON dump, creating it (by parsing the dump) if it does not exist yet.
+
+    :param json_path: The path of the JSON dump created by LND describegraph command.
+    :param snapshot_dir: The directory of the snapshots. By default it's the directory of the dump.
+    :return: The snapshot of the dump.
+    """
+    snapshot_path = get_snapshot_path(json_path, snapshot_dir)
+    if os.path.exists(snapshot_path):
+        return GraphSnapshot.load(snapshot_path)
+
+    snapshot = GraphSnapshot.from_dump(*read_dump(json_path))
+    snapshot.save(snapshot_path)
+    return snapshot
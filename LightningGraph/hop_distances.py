@@ -0,0 +1,171 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import networkx as nx
+import numpy as np
+
+
+def get_hop_distances_dtype(n_nodes: int) -> type:
+    """
+    :param n_nodes: The number of nodes in the graph.
+    :return: The smallest unsigned integer type that holds every hop-distance in the graph (which is at most n-1)
+             as well as the unreachable value (which is the maximal value of the type).
+    """
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if n_nodes <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def get_unreachable_value(dtype) -> int:
+    """
+    :return: The value marking a node that is unreachable from the source in a hop-distances array of the given type.
+             Since it's the maximal value of the type, taking the minimum over distances works as expected.
+    """
+    return np.iinfo(dtype).max
+
+
+def hop_distances_to_float(distances: np.ndarray) -> np.ndarray:
+    """
+    :param distances: An array of hop-distances (as created by build_hop_distance_matrix).
+    :return: The same distances as a float32 array, with np.inf for the unreachable nodes.
+    """
+    float_distances = distances.astype(np.float32)
+    float_distances[distances == get_unreachable_value(distances.dtype)] = np.inf
+    return float_distances
+
+
+def get_adjacency(graph: nx.Graph, nodes: List) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build an integer CSR adjacency of the graph, where the nodes are mapped to their index in the given list.
+    Parallel edges are merged, so the neighbors of each node are unique.
+
+    :param graph: The graph.
+    :param nodes: A list of the nodes in the graph (defines the integer index of each node).
+    :return: A tuple (indptr, neighbors), where the neighbors of node i are neighbors[indptr[i]:indptr[i+1]].
+    """
+    node_index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(node_index[u], node_index[v]) for u, v in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)  # Both directions, sorted by the first node
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=len(nodes)), out=indptr[1:])
+    return indptr, edges[:, 1].copy()
+
+
+def get_hop_distances(indptr: np.ndarray, neighbors: np.ndarray, source: int, dtype) -> np.ndarray:
+    """
+    Run a BFS from the given source over the given CSR adjacency.
+    The BFS is level-synchronous, so the neighbors of the entire frontier are gathered at once.
+
+    :return: An array containing the hop-distance from the source to each node
+             (or the unreachable value of the given type for the nodes that are unreachable from the source).
+    """
+    unreachable = get_unreachable_value(dtype)
+    distances = np.full(len(indptr) - 1, unreachable, dtype=dtype)
+    distances[source] = 0
+
+    frontier = np.array([source], dtype=np.int64)
+    distance = 0
+    while len(frontier) > 0:
+        distance += 1
+        starts = indptr[frontier]
+        lengths = indptr[frontier + 1] - starts
+
+        # The positions of the neighbors of all of the frontier nodes in the neighbors array.
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1]) + np.repeat(starts - ends + lengths, lengths)
+
+        candidates = neighbors[positions]
+        frontier = np.unique(candidates[distances[candidates] == unreachable])
+        distances[frontier] = distance
+
+    return distances
+
+
+def fill_hop_distance_rows(distance_matrix: np.ndarray, indptr: np.ndarray, neighbors: np.ndarray,
+                           sources: range):
+    """
+    Fill the rows of the given sources in the given distance matrix.
+    """
+    for source in sources:
+        distance_matrix[source] = get_hop_distances(indptr, neighbors, source, distance_matrix.dtype)
+
+
+# The adjacency and the output of a worker process (see build_hop_distance_matrix).
+_worker_indptr = None
+_worker_neighbors = None
+_worker_dtype = None
+_worker_memmap_path = None
+
+
+def _init_hop_distances_worker(indptr, neighbors, dtype, memmap_path):
+    global _worker_indptr, _worker_neighbors, _worker_dtype, _worker_memmap_path
+    _worker_indptr, _worker_neighbors, _worker_dtype, _worker_memmap_path = indptr, neighbors, dtype, memmap_path
+
+
+def _fill_hop_distance_rows_in_worker(sources: range):
+    """
+    Compute the rows of the given sources.
+    If the output is a memmap the rows are written to it directly, otherwise they are returned.
+    """
+    n = len(_worker_indptr) - 1
+    if _worker_memmap_path is not None:
+        distance_matrix = np.memmap(_worker_memmap_path, dtype=_worker_dtype, mode='r+', shape=(n, n))
+        fill_hop_distance_rows(distance_matrix, _worker_indptr, _worker_neighbors, sources)
+        distance_matrix.flush()
+        return None
+
+    rows = np.empty(shape=(len(sources), n), dtype=_worker_dtype)
+    for i, source in enumerate(sources):
+        rows[i] = get_hop_distances(_worker_indptr, _worker_neighbors, source, _worker_dtype)
+    return rows
+
+
+def build_hop_distance_matrix(graph: nx.Graph, nodes: List, workers: int = 1, memmap_path: str = None,
+                              dtype=None) -> np.ndarray:
+    """
+    Build the matrix of the hop-distances between every two nodes in the graph, by running a BFS from each node
+    over an integer adjacency of the graph.
+
+    :param graph: The graph.
+    :param nodes: A list of the nodes in the graph.
+                  This is important because we want the order of the nodes to be the same,
+                  and calling graph.nodes does not necessarily maintain the order.
+    :param workers: The number of worker processes to run the BFS-s with (1 means no worker processes).
+                    The sources are split to contiguous ranges, one for each worker.
+    :param memmap_path: If it's given, the matrix is written to a np.memmap in this path instead of residing in RAM
+                        (needed for the matrix of the entire network).
+    :param dtype: The unsigned integer type of the matrix. The default is the smallest one that fits the graph
+                  (uint8 for up to 255 nodes, uint16 for up to 65535 nodes).
+    :return: A 2D NumPy array which is the hop-distance between every two nodes in the graph.
+             Unreachable pairs have the maximal value of the type (see get_unreachable_value).
+    """
+    n = len(nodes)
+    if dtype is None:
+        dtype = get_hop_distances_dtype(n)
+    indptr, neighbors = get_adjacency(graph, nodes)
+
+    if memmap_path is not None:
+        distance_matrix = np.memmap(memmap_path, dtype=dtype, mode='w+', shape=(n, n))
+    else:
+        distance_matrix = np.empty(shape=(n, n), dtype=dtype)
+
+    if workers > 1 and n > 0:
+        shard_size = -(-n // workers)  # Ceiling division
+        shards = [range(i, min(i + shard_size, n)) for i in range(0, n, shard_size)]
+        if memmap_path is not None:
+            distance_matrix.flush()  # The workers open the file by themselves
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_hop_distances_worker,
+                                 initargs=(indptr, neighbors, dtype, memmap_path)) as executor:
+            for sources, rows in zip(shards, executor.map(_fill_hop_distance_rows_in_worker, shards)):
+                if rows is not None:
+                    distance_matrix[sources.start:sources.stop] = rows
+    else:
+        fill_hop_distance_rows(distance_matrix, indptr, neighbors, range(n))
+
+    if memmap_path is not None:
+        distance_matrix.flush()
+
+    return distance_matrix
@@ -83,6 +83,42 @@ def infer_node_implementation(node, neighbours):
         return "unknown"
 
 
+def infer_nodes_implementations(graph):
+    """
+    infers the implementations of all of the nodes in the graph at once (exactly like infer_node_implementation).
+    The parameters of all the half-channels are gathered to a single array, the implementation distribution of each
+    distinct parameters tuple is calculated once (a lookup table), and the distributions are summed per node with a
+    single np.add.at. The half-channels of each node are ordered like in infer_node_implementation, so the sums
+    (and therefore the labels) are identical.
+    :return: A dictionary mapping each node to its implementation (or "unknown").
+    """
+    nodes = list(graph.nodes)
+    # The index of the node and the (cltv_delta, min_htlc, fee_proportional) values of the node for each half-channel.
+    channels_nodes = list()
+    channels_parameteres = list()
+    for i, node in enumerate(nodes):
+        neighbours = graph.adj[node]._atlas
+        for adj_node_id in neighbours:
+            for channel in neighbours[adj_node_id].values():
+                channels_nodes.append(i)
+                channels_parameteres.append(calc_node_attr(node, channel))
+
+    impl_dist = np.zeros((len(nodes), len(IMPLEMENTATIONS)))
+    if len(channels_parameteres) > 0:
+        unique_parameteres, channels_unique_index = np.unique(np.array(channels_parameteres, dtype=np.float64),
+                                                              axis=0, return_inverse=True)
+        unique_impl_dist = np.array([calc_implementation_distribution(channel_params)
+                                     for channel_params in unique_parameteres])
+        np.add.at(impl_dist, np.array(channels_nodes), unique_impl_dist[channels_unique_index.ravel()])
+
+    impl_dist_sum = impl_dist.sum(axis=1)
+    is_known = impl_dist_sum != 0
+    labels = np.full(len(nodes), "unknown", dtype=object)
+    labels[is_known] = np.array(IMPLEMENTATIONS, dtype=object)[
+        np.argmax(impl_dist[is_known] / impl_dist_sum[is_known, np.newaxis], axis=1)]
+    return dict(zip(nodes, labels.tolist()))
+
+
 #############################################################################################
 # Simplistic heuristics to infer implementation. We used the above one, but this gave approximately the same
 # results.
@@ -1,14 +1,19 @@
+import copy
 import os
-import random
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 import networkx as nx
 import numpy as np
 
-from routing.LND_routing import get_route
+from LightningGraph.compiled_graph import CompiledChannelGraph
+from routing.LND_routing import LNDRouter
+from routing.route_cache import RouteCache, MISSING
 from utils.common import LND_DEFAULT_POLICY
 from utils.common import calculate_route_fees, get_new_position_for_agent_node
-from utils.visualizers import visualize_graph_state
+from utils.frame_rendering import FrameDelta, FrameScene, SimulationFramesPipeline
+from utils.graph_helpers import get_graph_positions, get_ordered_sub_graph
+from utils.metrics import MetricsRecorder
+from utils.workloads import Workload, UniformWorkload
 
 
 def transfer_money_in_graph(graph: nx.MultiGraph, amount: int, route: List, verbose: bool = False) -> int:
@@ -83,59 +88,274 @@ class LightningSimulator:
     """
 
     def __init__(self, graph: nx.MultiGraph, num_transactions, transfer_amount, other_balance_proportion, 
-                 verbose=False):
+                 verbose=False, batch_size=10 ** 4, route_cache: RouteCache = None, rng: np.random.Generator = None,
+                 workload: Workload = None, amount_buckets_per_octave: int = 4):
         self.graph: nx.MultiGraph = graph
         self.other_balance_proportion = other_balance_proportion
-        # For plotting the graph in networkX framework, each node (vertex) has position (x,y)
-        self.positions = nx.spring_layout(self.graph)
+        # The positions of the nodes for plotting, computed on demand (see the positions property).
+        self._positions = None
         self.num_transactions = num_transactions
         self.transfer_amount = transfer_amount
         self.agent_pub_key = None
         self.verbose = verbose
-        self.route_memory = dict()
+        # The random generator of the transactions (by default a new one, seeded from the OS).
+        self.rng: np.random.Generator = rng if rng is not None else np.random.default_rng()
+        # The distribution of the transactions (by default uniform over the pairs of nodes, transferring
+        # transfer_amount).
+        self.workload: Workload = workload if workload is not None else UniformWorkload()
+        # The number of transactions that are sampled and routed together.
+        self.batch_size = batch_size
+        # The weights of the routing depend on the amount, so the transactions are routed for their amounts rounded
+        # on a log scale, with this number of amount buckets per doubling of the amount (see get_amount_buckets).
+        # The bucket of transfer_amount is routed for exactly transfer_amount.
+        self.amount_buckets_per_octave = amount_buckets_per_octave
+        # Maps (source, target) indices of nodes in the compiled graph and an amount bucket to the route between them,
+        # priced for transferring the amount of the bucket (or None if there is no route).
+        # By default it's unbounded and never invalidates routes (see routing.route_cache for the other options).
+        self.route_memory: RouteCache = route_cache if route_cache is not None else RouteCache()
         self.successfull_transactions = 0
+        # The channels added by the agent. They are not added to self.graph (which is shared with the clones of the
+        # simulator), but applied as an overlay on the compiled graph (see get_compiled_graph).
+        self.agent_channels: List[Dict] = list()
+        # The capacity the agent's channels add to the total capacity of their nodes (which is not updated in
+        # self.graph either, see get_node_total_capacity).
+        self.agent_channels_capacities: Dict[str, float] = dict()
+        # The array-backed version of the graph (including the agent's channels) which is used while running the
+        # simulation, and holds its balances. It's compiled on demand.
+        self.compiled_graph = None
+        # The slots of the agent's channels (in the compiled graph), set when the simulation runs.
+        self.agent_slots = frozenset()
+
+    @property
+    def positions(self) -> Dict:
+        """
+        For plotting the graph in networkX framework, each node (vertex) has position (x,y).
+        The layout is slow, so it's computed (and cached) only when it's needed, i.e. when visualizing.
+        The agent's node is placed to the right of the rest of the graph.
+        """
+        if self._positions is None:
+            nodes = [node for node in self.graph.nodes if node != self.agent_pub_key]
+            self._positions = dict(get_graph_positions(get_ordered_sub_graph(self.graph, nodes)))
+            if self.agent_pub_key is not None:
+                self._positions[self.agent_pub_key] = get_new_position_for_agent_node(self._positions)
+        return self._positions
+
+    def get_compiled_graph(self) -> CompiledChannelGraph:
+        """
+        :return: The compiled graph of the simulator (compiling it if needed).
+        """
+        if self.compiled_graph is None:
+            self.compiled_graph = CompiledChannelGraph(self.graph).with_channels(self.agent_channels)
+        return self.compiled_graph
 
-    def run(self, plot_dir=None):
+    def clone(self, rng: np.random.Generator = None) -> 'LightningSimulator':
+        """
+        Create a copy of the simulator which can be changed (i.e. have channels added and run) independently.
+        This replaces deepcopy(simulator): the networkx graph, the policies, the positions (if computed) and the
+        topology of the compiled graph are shared with the clone, and only the balances array and the route memory
+        are copied.
+        Hence the shared graph must not be modified after cloning (which the simulator does not do).
+
+        :param rng: The random generator of the clone.
+                    By default it's a copy of this simulator's generator, so the clone samples the same transactions.
+        :return: The new simulator.
+        """
+        simulator = copy.copy(self)
+        simulator.compiled_graph = self.get_compiled_graph().copy()
+        simulator.agent_channels = list(self.agent_channels)
+        simulator.agent_channels_capacities = dict(self.agent_channels_capacities)
+        simulator.route_memory = self.route_memory.copy()
+        simulator.rng = rng if rng is not None else copy.deepcopy(self.rng)
+        return simulator
+
+    def get_frame_scene(self) -> FrameScene:
+        """
+        :return: The static parts of the frames of the simulation (the nodes and the channels, including the agent's).
+        """
+        compiled_graph = self.get_compiled_graph()
+        node_ids = compiled_graph.node_ids
+        channels = [(node_ids[compiled_graph.slot_sender[2 * c]], node_ids[compiled_graph.slot_receiver[2 * c]],
+                     channel_id) for c, channel_id in enumerate(compiled_graph.channel_ids)]
+        node_labels = {node: self.graph.nodes[node]['serial_number'] for node in node_ids}
+        return FrameScene(node_ids, self.positions, node_labels, channels)
+
+    def run(self, plot_dir=None, metrics_recorder: MetricsRecorder = None, render_workers: int = 1):
         """
         This function runs the experiment, and plot if needed.
-        :param plot_dir:
+        The routing and the transfers run over the compiled graph of the simulator.
+        :param plot_dir: If it's given, an animation of the transactions is created in plot_dir/simulation.gif.
+                         Its frames are rendered in parallel to the simulation (see utils.frame_rendering).
+        :param metrics_recorder: The recorder to record the metrics of the steps to.
+                                 The default records the agent's balance and the number of routes via the agent
+                                 in each step.
+        :param render_workers: The number of worker processes to render the frames of the animation with.
+        :return: The agent's balance and the cumulative number of routes via the agent in the recorded steps.
         """
-        cumulative_balances = [self.get_node_balance(self.agent_pub_key)]
-        numbers_of_routes_via_agent_per_step = [0]
-
-        for step in range(self.num_transactions):
-            # Sample random nodes
-            possible_nodes = [node_pub_key for node_pub_key in self.graph.nodes if node_pub_key != self.agent_pub_key]
-            node1, node2 = random.sample(possible_nodes, 2)
-
-            if (node1, node2) not in self.route_memory:
-                route = get_route(self.graph, node1, node2, self.transfer_amount)
-                self.route_memory[(node1, node2)] = route
-
-            route = self.route_memory[(node1, node2)]
-
-            numbers_of_routes_via_agent_per_step.append(numbers_of_routes_via_agent_per_step[-1])
-            # If the routing was not successful, nothing to do.
-            if route is not None:
+        self.get_compiled_graph()
+        router = LNDRouter(self.compiled_graph)
+        node_index = self.compiled_graph.node_index
+        agent_index = node_index[self.agent_pub_key]
+        self.agent_slots = frozenset(self.compiled_graph.outgoing_slots(agent_index).tolist())
+
+        if metrics_recorder is None:
+            metrics_recorder = MetricsRecorder(self.num_transactions + 1)
+        record_agent_fee = 'agent_fee' in metrics_recorder
+
+        number_of_routes_via_agent = 0
+        # Step 0 is the state before the first transaction, and step i is the state after the i-th transaction.
+        metrics_recorder.record_steps(0, agent_balance=[self.compiled_graph.get_node_balance(agent_index)],
+                                      routes_via_agent=[number_of_routes_via_agent], failing_hop=[-1])
+
+        # The transactions are generated and routed in batches, and then transferred one after the other.
+        transactions = self.workload.stream(self.compiled_graph, self.num_transactions, self.batch_size,
+                                            self.transfer_amount, self.rng, excluded_nodes=[agent_index])
+        batch_start = 0
+        frames_pipeline = None
+        if plot_dir is not None:
+            os.makedirs(plot_dir, exist_ok=True)
+            frames_pipeline = SimulationFramesPipeline(self.get_frame_scene(), self.compiled_graph.balance,
+                                                       os.path.join(plot_dir, "simulation.gif"), render_workers)
+        try:
+            for transactions_chunk in transactions:
+                amounts = transactions_chunk.amounts.tolist()
+                keys = list(zip(transactions_chunk.sources.tolist(), transactions_chunk.targets.tolist(),
+                                self.get_amount_buckets(transactions_chunk.amounts).tolist()))
+                routes = self._get_routes(router, keys)
+                # The metrics of the steps of the batch, which are recorded at the end of the batch.
+                agent_balances, routes_via_agent, successes, hops, agent_fees, failing_hops = [], [], [], [], [], []
+
+                for step, (key, amount, route) in enumerate(zip(keys, amounts, routes), start=batch_start):
+                    source, target, amount_bucket = key
+                    bucket_amount = self.get_bucket_amount(amount_bucket)
+                    if route is not None and amount != bucket_amount:
+                        # The routes are found (and memorized) for transferring the amount of the bucket,
+                        # so price the route again for the amount of this transaction.
+                        route = self.compiled_graph.price_route(route.slots, amount)
+                    succeeded = False
+                    debug_last_node_index_in_route = -1
+                    agent_fee = 0
+                    # If the routing was not successful, nothing to do.
+                    if route is not None:
+
+                        # Gets the index of the last node that can get the money (if the money was
+                        # transferred, this is node2).
+                        debug_last_node_index_in_route = self.compiled_graph.transfer_priced_route(route)
+                        succeeded = debug_last_node_index_in_route == len(route.slots)
+                        if succeeded:
+                            self.successfull_transactions += 1
+                            if self.is_agent_in_route(route):
+                                number_of_routes_via_agent += 1
+                                if record_agent_fee:
+                                    agent_fee = route.node_deltas_list[route.nodes_list.index(agent_index)]
+
+                        if self.route_memory.record_transfer(key, succeeded):
+                            # The route keeps failing, so route the pair again avoiding the channels which can not
+                            # transfer the amount at the moment (if there is no such route, the pair is routed as usual
+                            # the next time). The following transactions of the pair in the current batch still use
+                            # the old route.
+                            new_route = self._route(router, source, target, bucket_amount, check_balances=True)
+                            if new_route is not None:
+                                self.route_memory.put(key, new_route)
+                        if frames_pipeline is not None:
+                            changed_slots = np.concatenate([route.slots, route.slots ^ 1]) if succeeded \
+                                else np.empty(0, dtype=np.int64)
+                            changed_balances = self.compiled_graph.balance[changed_slots]
+                            frames_pipeline.emit(FrameDelta(step, changed_slots, changed_balances, route.slots,
+                                                            debug_last_node_index_in_route))
+
+                    agent_balances.append(self.compiled_graph.get_node_balance(agent_index))
+                    routes_via_agent.append(number_of_routes_via_agent)
+                    successes.append(succeeded)
+                    hops.append(0 if route is None else len(route.slots_list))
+                    agent_fees.append(agent_fee)
+                    failing_hops.append(-1 if succeeded else debug_last_node_index_in_route)
+
+                metrics_recorder.record_steps(batch_start + 1, agent_balance=agent_balances,
+                                              routes_via_agent=routes_via_agent, success=successes, hops=hops,
+                                              agent_fee=agent_fees, failing_hop=failing_hops)
+                metrics_recorder.flush()
+                batch_start += len(keys)
+            if frames_pipeline is not None:
+                frames_pipeline.close()
+        finally:
+            if frames_pipeline is not None:
+                # If the simulation failed, stop rendering the frames (it does nothing if the pipeline was closed).
+                frames_pipeline.cancel()
+        return metrics_recorder.columns['agent_balance'], metrics_recorder.columns['routes_via_agent']
+
+    def get_amount_buckets(self, amounts: np.ndarray) -> np.ndarray:
+        """
+        :param amounts: The amounts of transactions.
+        :return: The amount bucket of each of the amounts, i.e. log2(amount / transfer_amount) rounded to multiples of
+                 1 / amount_buckets_per_octave (so the bucket of transfer_amount is 0).
+        """
+        return np.rint(np.log2(np.asarray(amounts) / self.transfer_amount) * self.amount_buckets_per_octave) \
+            .astype(np.int64)
 
-                # Gets the index of the last node that can get the money (if the money was
-                # transferred, this is node2).
-                debug_last_node_index_in_route = transfer_money_in_graph(self.graph, self.transfer_amount, route)
-                if debug_last_node_index_in_route == len(route):
-                    self.successfull_transactions += 1
-                    if self.is_agent_in_route(route):
-                        numbers_of_routes_via_agent_per_step[-1] += 1
-                if plot_dir is not None:
-                    os.makedirs(plot_dir, exist_ok=True)
-                    visualize_graph_state(self.graph, self.positions,
-                                          transfer_routes=[(route, debug_last_node_index_in_route)],
-                                          out_path=os.path.join(plot_dir, f"step-{step}"),
-                                          verify_node_serial_number=False,
-                                          plot_title=f"step-{step}")
+    def get_bucket_amount(self, amount_bucket: int):
+        """
+        :return: The amount the transactions of the given amount bucket are routed for.
+        """
+        if amount_bucket == 0:
+            return self.transfer_amount
+        return round(self.transfer_amount * 2 ** (amount_bucket / self.amount_buckets_per_octave))
 
-            cumulative_balances.append(self.get_node_balance(self.agent_pub_key))
+    def _get_routes(self, router: LNDRouter, keys: List[Tuple[int, int, int]]) -> List:
+        """
+        Get the routes of the given transactions from the route memory, routing the ones that are missing.
+        The routing does not depend on the balances, so the routes of a batch of transactions can be found
+        before transferring any of them.
+
+        :param router: The router of the compiled graph.
+        :param keys: The (source, target) indices of the nodes and the amount bucket of each transaction.
+        :return: A list with the route of each transaction, priced for the amount of its bucket, or None if there is
+                 no route.
+        """
+        routes = list()
+        # The routes to the (target, amount bucket) that were routed in this batch (which might be evicted from a
+        # bounded route memory).
+        routes_to_targets = dict()
+
+        for key in keys:
+            route = self.route_memory.get(key)
+            if route is MISSING:
+                source, target, amount_bucket = key
+                if (target, amount_bucket) not in routes_to_targets:
+                    # Compute the routes from all of the nodes to the target at once, as they are found in the same
+                    # run of the routing algorithm anyway.
+                    amount = self.get_bucket_amount(amount_bucket)
+                    routes_to_targets[(target, amount_bucket)] = {
+                        routes_source: self._price_route(routes_source_route, amount)
+                        for routes_source, routes_source_route in router.get_routes_to_target(target, amount).items()}
+                    # An unbounded memory keeps all of the missing ones, a bounded one only the routes that are used.
+                    # The routes that are already in the memory are kept, since they might have been routed again
+                    # (e.g. after their transfers failed).
+                    if self.route_memory.max_size is None:
+                        for routes_source, routes_source_route in routes_to_targets[(target, amount_bucket)].items():
+                            if (routes_source, target, amount_bucket) not in self.route_memory:
+                                self.route_memory.put((routes_source, target, amount_bucket), routes_source_route)
+
+                route = routes_to_targets[(target, amount_bucket)][source]
+                if self.route_memory.max_size is not None:
+                    self.route_memory.put(key, route)
+
+            routes.append(route)
+
+        return routes
+
+    def _route(self, router: LNDRouter, source: int, target: int, amount, check_balances: bool = False):
+        """
+        :return: The route from the given source to the given target, priced for transferring the given amount,
+                 or None if there is no route.
+        """
+        return self._price_route(router.get_route(source, target, amount, check_balances=check_balances), amount)
 
-        return cumulative_balances, numbers_of_routes_via_agent_per_step
+    def _price_route(self, route, amount):
+        """
+        :param route: An array of slots, or None.
+        :return: The route priced for transferring the given amount, or None if route is None.
+        """
+        return None if route is None else self.compiled_graph.price_route(route, amount)
 
     def create_agent_node(self):
         """
@@ -149,39 +369,49 @@ class LightningSimulator:
         serial_num = len(self.graph.nodes) + 1
         pub_key = "Agent-" + str(serial_num)
 
-        # Add the node to networkX graph
+        # Add the node to networkX graph (and compile the graph again when needed)
         self.graph.add_node(pub_key, pub_key=pub_key, serial_number=serial_num, total_capacity=0)
+        self.compiled_graph = None
 
-        # Define the position of the new node (for plotting the networkX graph)
-        self.positions[pub_key] = get_new_position_for_agent_node(self.positions)
+        # Define the position of the new node (for plotting the networkX graph), unless they are not computed yet
+        if self._positions is not None:
+            self._positions[pub_key] = get_new_position_for_agent_node(self._positions)
 
         self.agent_pub_key = pub_key
         return pub_key
 
     def get_node_balance(self, node_public_key):
         """
-        This function traverse through all the neighbors of a specific node and sum the money
-        it has in each channel.
+        This function sums the money a specific node has in each of its channels.
         :param node_public_key: public_key of the node
         :return: Sums the balances of the node from all his channels.
         """
-        total_balance = 0
+        compiled_graph = self.get_compiled_graph()
+        return compiled_graph.get_node_balance(compiled_graph.node_index[node_public_key])
 
-        # Get the connected edges of this node and traverse them and sum the balance.
-        connected_edges = self.graph.edges(node_public_key, data=True)
-        for _, _, edge_data in connected_edges:
-            node_i = 1 if (node_public_key == edge_data['node1_pub']) else 2
-            total_balance += edge_data[f'node{node_i}_balance']
-
-        return total_balance
+    def get_node_total_capacity(self, node_public_key):
+        """
+        :param node_public_key: public_key of the node
+        :return: The total capacity of the node's channels, including the channels added by the agent.
+        """
+        return self.graph.nodes[node_public_key]['total_capacity'] + \
+            self.agent_channels_capacities.get(node_public_key, 0)
 
     def add_edges(self, edges: List[Dict]):
         """
         Add a list of edges to the graph.
         :param edges: A list of edges to add to the graph.
         """
+        compiled_graph = self.get_compiled_graph()
+        channels = list()
         for edge in edges:
-            self.add_edge(**edge)
+            channels.append(self._create_channel(**edge))
+            self.agent_channels.append(channels[-1])
+            # Updates the total capacity according to the new channel capacity
+            for node_pub in [edge['node1_pub'], edge['node2_pub']]:
+                self.agent_channels_capacities[node_pub] = \
+                    self.agent_channels_capacities.get(node_pub, 0) + channels[-1]['capacity']
+        self.compiled_graph = compiled_graph.with_channels(channels)
 
     def add_edge(self, node1_pub, node2_pub, node1_policy, node1_balance):
         """
@@ -192,7 +422,13 @@ class LightningSimulator:
         :param node1_policy:
         :param node1_balance: node1 balance
         """
+        self.add_edges([dict(node1_pub=node1_pub, node2_pub=node2_pub,
+                             node1_policy=node1_policy, node1_balance=node1_balance)])
 
+    def _create_channel(self, node1_pub, node2_pub, node1_policy, node1_balance) -> Dict:
+        """
+        :return: The attributes of a new channel from node1 to node2 (like the edges data of the graph).
+        """
         node2_balance = self.other_balance_proportion*node1_balance
         if self.verbose:
             print(f"\tManager | Adding edge between "
@@ -200,24 +436,17 @@ class LightningSimulator:
                   f" and node({self.graph.nodes[node2_pub]['serial_number']})")
 
         capacity = node1_balance + node2_balance
-        channel_id = str(len(self.graph.edges) + 1)
-
-        self.graph.add_edge(node1_pub, node2_pub, key=channel_id,
-                            channel_id=channel_id, node1_pub=node1_pub, node2_pub=node2_pub,
-                            node1_policy=node1_policy, node2_policy=LND_DEFAULT_POLICY,
-                            capacity=capacity, node1_balance=node1_balance, node2_balance=node2_balance)
+        channel_id = str(len(self.graph.edges) + len(self.agent_channels) + 1)
 
-        # Updates the total capacity according to the new channel capacity
-        for node_pub in [node1_pub, node2_pub]:
-            self.graph.nodes[node_pub]['total_capacity'] += capacity
+        return dict(channel_id=channel_id, node1_pub=node1_pub, node2_pub=node2_pub,
+                    node1_policy=node1_policy, node2_policy=LND_DEFAULT_POLICY,
+                    capacity=capacity, node1_balance=node1_balance, node2_balance=node2_balance)
 
     def is_agent_in_route(self, route):
         """
         Check if agent appear in the route
-        :param route: list of edges
+        :param route: A priced route in the compiled graph
         :return: True iff agent is in the route
         """
-        for node1, node2, channel_id in route:
-            if node1 == self.agent_pub_key:
-                return True
-        return False
+        # The agent is never the source or the target, so it's in the route iff it transfers money in the route.
+        return not self.agent_slots.isdisjoint(route.slots_list)
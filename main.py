@@ -1,6 +1,9 @@
+import io
 import os
 from collections import defaultdict
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
 from time import time
 
 import matplotlib.pyplot as plt
@@ -8,40 +11,66 @@ import numpy as np
 import pickle
 
 from LightningSimulator import LightningSimulator
+from routing.route_cache import create_route_cache
 from utils.common import human_format
 from utils.graph_helpers import create_sub_graph_by_node_capacity
+from utils.metrics import MetricsRecorder, METRICS_COLUMNS
+from utils.seeding import GRAPH_STREAM, SIMULATIONS_STREAM, get_child_rng, get_child_seed_sequence, \
+    get_root_seed_sequence, spawn_rngs
 from utils.visualizers import plot_experiment_mean_and_std
+from utils.workloads import UniformAmounts, create_workload
 from opt import *
 
 
-def get_simulator():
+def get_simulator(rng=None):
     """
     Builds the simulator from a simplified version of the lightning dump
+    :param rng: The random generator of the dummy balances of the graph.
     :return: Simulator
     """
     graph = create_sub_graph_by_node_capacity(k=SIMULATOR_NUM_NODES,
-                                              highest_capacity_offset=GRAPH_DENSITY_OFFSET)
+                                              highest_capacity_offset=GRAPH_DENSITY_OFFSET,
+                                              rng=rng)
     simulator = LightningSimulator(graph, num_transactions=SIMULATOR_NUM_TRANSACTIONS,
                                    transfer_amount=SIMULATOR_TRANSFERS_MAX_AMOUNT,
-                                   other_balance_proportion=SIMULATOR_PASSIVE_SIDE_BALANCE_PROPORTION)
+                                   other_balance_proportion=SIMULATOR_PASSIVE_SIDE_BALANCE_PROPORTION,
+                                   workload=get_workload(),
+                                   amount_buckets_per_octave=SIMULATOR_AMOUNT_BUCKETS_PER_OCTAVE,
+                                   route_cache=create_route_cache(ROUTE_CACHE_EVICTION, ROUTE_CACHE_SIZE,
+                                                                  ROUTE_CACHE_MAX_CONSECUTIVE_FAILURES))
     return simulator
 
 
+def get_workload():
+    """
+    :return: The workload of the simulations, according to SIMULATOR_WORKLOAD and SIMULATOR_VARIABLE_AMOUNTS.
+    """
+    amounts = UniformAmounts(1, SIMULATOR_TRANSFERS_MAX_AMOUNT) if SIMULATOR_VARIABLE_AMOUNTS else None
+    return create_workload(SIMULATOR_WORKLOAD, amounts, SIMULATOR_WORKLOAD_REPLAY_PATH)
+
+
 def run_experiment(agent_constructors, out_dir, plot_graph_transactions=False, use_number_of_transactions=False):
     """
     Creates a Lightning simulator, common to all of the given agents.
     For each agent:
     1. Ask agent for edges it wants to establish given a funds constraint.
-    2. Add edges to a copy of the simulator.
+    2. Add edges to a clone of the simulator.
     3. Repeat simulation and plot average results.
+    The simulations (of all of the agents and repeats) are independent, so they run in WORKERS processes in parallel.
+    All of the random streams (of the graph, and of the agent and the simulator in each simulation) are derived
+    from the SEED, and the stream of each simulation depends only on its agent and repeat,
+    so the results do not depend on the number of workers.
 
     :param agent_constructors: list of tuples of an agent constructor and additional kwargs
     :param out_dir: debug outputs dir
-    : plot_graph_transactions:  create visualisaztion image for each transaction (very slow)
+    : plot_graph_transactions:  create an animation of the transactions of each simulation (very slow)
     """
-    # Create the base Simulator which will be copied for each simulation
-    simulator = get_simulator()
-    new_node_pub_key = simulator.create_agent_node()
+    root_seed_sequence = get_root_seed_sequence(SEED)
+    print(f"Seed: {root_seed_sequence.entropy}")
+
+    # Create the base Simulator which will be cloned for each simulation
+    simulator = get_simulator(get_child_rng(root_seed_sequence, GRAPH_STREAM))
+    simulator.create_agent_node()
 
     # For each agent store a list of lists:
     # Each inner list is the cumulative revenues for the corresponding simulation.
@@ -51,48 +80,121 @@ def run_experiment(agent_constructors, out_dir, plot_graph_transactions=False, u
     # Each inner list is the the nuber of transaction that pass via the agent in the  corresponding simulation.
     results_num_transaction = defaultdict(list)
 
-    for (agent_constructor, kwargs) in agent_constructors:
+    jobs = [(agent_constructor, kwargs, repeat,
+             get_child_seed_sequence(root_seed_sequence, SIMULATIONS_STREAM, agent_i, repeat),
+             out_dir, plot_graph_transactions)
+            for agent_i, (agent_constructor, kwargs) in enumerate(agent_constructors)
+            for repeat in range(NUMBER_REPEATED_SIMULATIONS)]
+
+    if WORKERS > 1:
+        # The base simulator is sent once to each worker (when the workers are forked it's not even copied).
+        executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_experiment_worker,
+                                       initargs=(simulator,))
+        simulations_results = executor.map(_run_simulation_in_worker, jobs)
+    else:
+        executor = None
+        simulations_results = map(partial(run_simulation, simulator), jobs)
+
+    try:
+        # The results arrive in the order of the jobs (i.e. the repeats of each agent one after the other).
+        for agent_name, repeat, output, simulation_cumulative_balance, numbers_of_transaction_via_agent \
+                in simulations_results:
+            if repeat == 0:
+                print("Agent:", agent_name)
+            print(output, end='')
+
+            results_num_transaction[agent_name].append(numbers_of_transaction_via_agent)
+            results_revenue[agent_name].append(simulation_cumulative_balance)
+
+            if repeat == NUMBER_REPEATED_SIMULATIONS - 1:
+                results_num_transaction[agent_name] = np.array(results_num_transaction[agent_name])
+                results_revenue[agent_name] = np.array(results_revenue[agent_name]) - INITIAL_FUNDS
+                # The results have a column for every METRICS_STRIDE transactions (and the state before them),
+                # i.e. their shape is (NUMBER_REPEATED_SIMULATIONS, SIMULATOR_NUM_TRANSACTIONS // METRICS_STRIDE + 1).
+                pickle.dump(results_revenue[agent_name],
+                            open(os.path.join(out_dir, f'{agent_name}-results_dict.pkl'), 'wb'))
+    finally:
+        # If a simulation fails, do not leave the workers running the rest of them.
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    plot_and_save_graph(results_revenue, "results_revenue_simulator_log", out_dir, METRICS_STRIDE)
+    plot_and_save_graph(results_num_transaction, "results_num_transaction_simulator_log", out_dir, METRICS_STRIDE)
+
+
+def run_simulation(simulator, job):
+    """
+    Run a single simulation of an agent over a clone of the given base simulator.
+
+    :param simulator: The base simulator, with the agent's node.
+    :param job: A tuple (agent constructor, additional kwargs, repeat, SeedSequence of the simulation,
+                         out_dir, plot_graph_transactions).
+    :return: A tuple (agent name, repeat, printed output, cumulative balance, numbers of transaction via agent).
+    """
+    agent_constructor, kwargs, repeat, seed_sequence, out_dir, plot_graph_transactions = job
+    agent_rng, simulator_rng = spawn_rngs(seed_sequence, 2)
+
+    # The output is returned instead of printed, so the outputs of parallel simulations do not interleave.
+    output = io.StringIO()
+    with redirect_stdout(output):
         # Create agent: A get_edges callable, an instance of a class inheriting AbstractAgent
-        agent = agent_constructor(public_key=new_node_pub_key,
+        agent = agent_constructor(public_key=simulator.agent_pub_key,
                                   initial_funds=INITIAL_FUNDS,
                                   channel_cost=LN_DEFAULT_CHANNEL_COST,
+                                  rng=agent_rng,
                                   **kwargs)
 
-        print("Agent:", agent.name)
-        for repeat in range(NUMBER_REPEATED_SIMULATIONS):
-            print(f"\trepeat {repeat}:")
-            simulator_copy = deepcopy(simulator)
+        print(f"\trepeat {repeat}:")
+        simulator_copy = simulator.clone(simulator_rng)
 
-            # Ask agent for edges to add.
-            new_edges = agent.get_channels(simulator_copy.graph)
+        # Ask agent for edges to add.
+        new_edges = agent.get_channels(simulator_copy.graph)
 
-            verify_channels(new_edges)
-            simulator_copy.add_edges(new_edges)
+        verify_channels(new_edges)
+        simulator_copy.add_edges(new_edges)
 
-            graph_debug_dir = os.path.join(out_dir, f"{agent.name}", f"sim-{repeat}") if plot_graph_transactions else None
+        graph_debug_dir = os.path.join(out_dir, f"{agent.name}", f"sim-{repeat}") if plot_graph_transactions else None
+        metrics_recorder = get_metrics_recorder(os.path.join(out_dir, f"{agent.name}", f"metrics-{repeat}"))
 
-            # Run the simulation
-            start = time()
-            simulation_cumulative_balance, numbers_of_transaction_via_agent = simulator_copy.run(graph_debug_dir)
-            print(f"\t\ttnx/sec: {human_format(SIMULATOR_NUM_TRANSACTIONS / (time() - start))}")
-            print(f"\t\tSuccessfull transactions rate: "
-                  f"{100*simulator_copy.successfull_transactions / float(SIMULATOR_NUM_TRANSACTIONS)}%")
+        # Run the simulation
+        start = time()
+        simulation_cumulative_balance, numbers_of_transaction_via_agent = simulator_copy.run(
+            graph_debug_dir, metrics_recorder, render_workers=VISUALIZATION_WORKERS)
+        print(f"\t\ttnx/sec: {human_format(SIMULATOR_NUM_TRANSACTIONS / (time() - start))}")
+        print(f"\t\tSuccessfull transactions rate: "
+              f"{100*simulator_copy.successfull_transactions / float(SIMULATOR_NUM_TRANSACTIONS)}%")
 
-            results_num_transaction[agent.name].append(numbers_of_transaction_via_agent)
-            results_revenue[agent.name].append(simulation_cumulative_balance)
+    return agent.name, repeat, output.getvalue(), simulation_cumulative_balance, numbers_of_transaction_via_agent
 
-        results_num_transaction[agent.name] = np.array(results_num_transaction[agent.name])
-        results_revenue[agent.name] = np.array(results_revenue[agent.name]) - INITIAL_FUNDS
-        pickle.dump(results_revenue[agent.name], open(os.path.join(out_dir, f'{agent.name}-results_dict.pkl'), 'wb'))
 
-    plot_and_save_graph(results_revenue, "results_revenue_simulator_log", out_dir)
-    plot_and_save_graph(results_num_transaction, "results_num_transaction_simulator_log", out_dir)
+# The base simulator of a worker process (see run_experiment).
+_worker_simulator = None
+
+
+def _init_experiment_worker(simulator):
+    global _worker_simulator
+    _worker_simulator = simulator
+
+
+def _run_simulation_in_worker(job):
+    return run_simulation(_worker_simulator, job)
+
+
+def get_metrics_recorder(metrics_dir):
+    """
+    :param metrics_dir: The directory to save the metrics in (if SAVE_METRICS is on).
+    :return: The recorder of the metrics of a simulation.
+    """
+    if SAVE_METRICS:
+        return MetricsRecorder(SIMULATOR_NUM_TRANSACTIONS + 1, columns=list(METRICS_COLUMNS), stride=METRICS_STRIDE,
+                               out_dir=metrics_dir)
+    return MetricsRecorder(SIMULATOR_NUM_TRANSACTIONS + 1, stride=METRICS_STRIDE)
 
 
-def plot_and_save_graph(experiment_results, file_name, out_dir):
+def plot_and_save_graph(experiment_results, file_name, out_dir, stride=1):
     fig = plt.figure(figsize=(12, 8))
     ax = plt.subplot(111)
-    plot_experiment_mean_and_std(experiment_results, ax)
+    plot_experiment_mean_and_std(experiment_results, ax, stride=stride)
     ax.legend(loc='upper center', ncol=2)
 
     fig.suptitle(get_experiment_description_string(prefix="plot-", delim=", "))
@@ -27,11 +27,53 @@ parser.add_argument('--SIMULATOR_NUM_NODES', type=int, default=50,
 parser.add_argument('--GRAPH_DENSITY_OFFSET', type=int, default=50,
                     help='The higher this number the more sparse the sub-graph is.'
                          'The nodes will be ordered by some metric and the M next nodes will be selected..')
+parser.add_argument('--SIMULATOR_WORKLOAD', type=str, default='uniform',
+                    help='The distribution of the pairs of nodes of the transactions: uniform, capacity (weighted by '
+                         'the total capacity of the nodes), degree (weighted by their degree), hot-pairs (a Zipf '
+                         'distribution over a few pairs) or replay (replay the transactions in '
+                         'SIMULATOR_WORKLOAD_REPLAY_PATH).')
+parser.add_argument('--SIMULATOR_WORKLOAD_REPLAY_PATH', type=str, default=None,
+                    help='A CSV file with the columns source, target (public keys) and optionally amount, '
+                         'for the replay workload. Like with SIMULATOR_VARIABLE_AMOUNTS, the transactions are routed '
+                         'for their amounts rounded to amount buckets.')
+parser.add_argument('--SIMULATOR_VARIABLE_AMOUNTS', action='store_true',
+                    help='Turn on to draw the amount of each transaction uniformly up to SIMULATOR_TRANSFERS_MAX_AMOUNT '
+                         '(instead of transferring exactly SIMULATOR_TRANSFERS_MAX_AMOUNT). The transactions are '
+                         'routed for their amounts rounded to amount buckets '
+                         '(see SIMULATOR_AMOUNT_BUCKETS_PER_OCTAVE), and priced for their exact amounts.')
+parser.add_argument('--SIMULATOR_AMOUNT_BUCKETS_PER_OCTAVE', type=int, default=4,
+                    help='The routes of the transactions are found (and cached) for their amounts rounded on a log '
+                         'scale, with this number of amount buckets per doubling of the amount. More buckets route '
+                         'the amounts more accurately, but cache more routes.')
+parser.add_argument('--ROUTE_CACHE_EVICTION', type=str, default='lru',
+                    help='The eviction policy of the routes cache of the simulator when it is bounded: fifo, lru or lfu.')
+parser.add_argument('--ROUTE_CACHE_SIZE', type=int, default=None,
+                    help='The maximal number of routes the simulator caches. By default the cache is unbounded.')
+parser.add_argument('--ROUTE_CACHE_MAX_CONSECUTIVE_FAILURES', type=int, default=None,
+                    help='Route a pair of nodes again (avoiding the channels that can not transfer the amount) after '
+                         'this number of consecutive failed transfers over its cached route. By default the cached '
+                         'routes are never invalidated.')
 parser.add_argument('--DEBUG_OUT_DIR', type=str, default="Experiments",
                     help='Where to save plots and images.')
 parser.add_argument('--VISUALIZE_TRANSACTIONS', action='store_true',
-                    help='Turn on to create debug images of the transactions in the simulator; this is very slow so'
-                         'make sure you work with short simulations.')
+                    help='Turn on to create an animation (simulation.gif) of the transactions in the simulator; this is '
+                         'very slow so make sure you work with short simulations.')
+parser.add_argument('--VISUALIZATION_WORKERS', type=int, default=1,
+                    help='The number of worker processes to render the frames of the animation of each simulation '
+                         '(while it runs) with.')
+parser.add_argument('--METRICS_STRIDE', type=int, default=1,
+                    help='Record the metrics of the simulation only every METRICS_STRIDE transactions. This also '
+                         'applies to the pickled results, which have SIMULATOR_NUM_TRANSACTIONS // METRICS_STRIDE + 1 '
+                         'columns.')
+parser.add_argument('--SAVE_METRICS', action='store_true',
+                    help='Turn on to save all of the per-transaction metrics of each simulation (e.g. success, hops, '
+                         'the fee the agent earned) as .npy files in the debug directory.')
+parser.add_argument('--WORKERS', type=int, default=1,
+                    help='The number of worker processes to run the simulations (of the different agents and repeats) '
+                         'in parallel.')
+parser.add_argument('--SEED', type=int, default=None,
+                    help='The root seed of the experiment, from which all of its random streams are derived. '
+                         'By default a fresh seed is drawn (and printed, so the experiment can be reproduced).')
 parser.add_argument('-l', '--list_of_experiments_names', nargs='+',
                     help='Parameter for the experiment name that will run', required=True)
 
@@ -54,6 +96,30 @@ SIMULATOR_NUM_NODES = args.SIMULATOR_NUM_NODES
 
 GRAPH_DENSITY_OFFSET = args.GRAPH_DENSITY_OFFSET
 
+SIMULATOR_WORKLOAD = args.SIMULATOR_WORKLOAD
+
+SIMULATOR_WORKLOAD_REPLAY_PATH = args.SIMULATOR_WORKLOAD_REPLAY_PATH
+
+SIMULATOR_VARIABLE_AMOUNTS = args.SIMULATOR_VARIABLE_AMOUNTS
+
+SIMULATOR_AMOUNT_BUCKETS_PER_OCTAVE = args.SIMULATOR_AMOUNT_BUCKETS_PER_OCTAVE
+
+ROUTE_CACHE_EVICTION = args.ROUTE_CACHE_EVICTION
+
+ROUTE_CACHE_SIZE = args.ROUTE_CACHE_SIZE
+
+ROUTE_CACHE_MAX_CONSECUTIVE_FAILURES = args.ROUTE_CACHE_MAX_CONSECUTIVE_FAILURES
+
 DEBUG_OUT_DIR = args.DEBUG_OUT_DIR
 
 VISUALIZE_TRANSACTIONS = args.VISUALIZE_TRANSACTIONS
+
+VISUALIZATION_WORKERS = args.VISUALIZATION_WORKERS
+
+METRICS_STRIDE = args.METRICS_STRIDE
+
+SAVE_METRICS = args.SAVE_METRICS
+
+WORKERS = args.WORKERS
+
+SEED = args.SEED
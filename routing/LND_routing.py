@@ -1,8 +1,9 @@
 import numpy as np
 import heapq
 import networkx as nx
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 import utils.common
+from LightningGraph.compiled_graph import CompiledChannelGraph
 RISK_FACTOR_BILLIONTHS = 15. / 1000000000
 
 
@@ -10,56 +11,53 @@ class UpdatablePrioritySet:
     """
     A data-structure that implements a priority set (i.e. min-heap with unique elements).
 
-    We're using the heapq to implement a priority queue, where the key is the return value of given function
-        (and we use the object's hash as a tie breaker).
-    We extend the functionality of heapq with the `update` function - which remove and re-insert a given object.
+    We're using the heapq to implement a priority queue, where the key is the given priority
+        (and we use the object itself as a tie breaker).
+    We extend the functionality of heapq with the `update` function - which changes the priority of a given object.
+    This is done using lazy deletion: the new entry is pushed to the heap, and the old entry stays in it and is
+    skipped when it's popped (since its priority is no longer the current priority of this object).
+    This keeps every operation O(log n), instead of removing the old entry from the middle of the heap in O(n).
     """
-    __slots__ = ('set', 'heap')
+    __slots__ = ('priorities', 'heap')
 
     def __init__(self):
-        # The set to enforce uniqueness.
-        self.set = set()
+        # The current priority of each element in the data-structure (also enforces uniqueness).
+        self.priorities = dict()
 
         # The heapq implements a priority queue.
         # The key is the weight of the path starting at this node and ending in 'target'.
+        # It may contain stale entries, which are entries whose priority is not the current one of their element.
         self.heap = list()
 
-    def update(self, node_id, old_weight, new_priority):
+    def update(self, node_id, new_priority):
         """
         Update an element in the data-structure.
         If it doesn't exist in the data-structure, add it (with the given 'new_priority' as a key).
         If this item already exists in the data-structure, update its key according to the given 'new_priority'.
 
         :param node_id: The id of the element to update.
-        :param old_weight: The old weight of the node. Can be None if the element does not exist yet.
         :param new_priority: The new priority for the given element.
         """
-        if node_id in self.set:  # avg: O(1), worst: O(log n)
-            try:
-                self.heap.remove((old_weight, node_id))  # O(n)
-            except ValueError:
-                # we didn't updated it in the previous time because it's too deep, so it's not in the list
-                pass
-        else:
-            self.set.add(node_id)  # avg: O(1), worst: O(log n)
-
+        self.priorities[node_id] = new_priority  # avg: O(1)
         heapq.heappush(self.heap, (new_priority, node_id))  # O(log n)
 
     def pop(self):
         """
         :return: The item with the minimal key from data-structure (and this item is removed from the data-structure).
         """
-        node_id = heapq.heappop(self.heap)[1]  # O(1)
-        if node_id not in self.set:
-            import pdb;pdb.set_trace()
-        self.set.remove(node_id)  # avg: O(1), worst: O(log n)
-        return node_id
+        while True:
+            priority, node_id = heapq.heappop(self.heap)  # O(log n)
+
+            # Skip stale entries - the element was already popped, or its priority was updated afterwards.
+            if self.priorities.get(node_id) == priority:
+                del self.priorities[node_id]
+                return node_id
 
     def is_empty(self):
         """
         :return: True if and only if the data-structure is empty.
         """
-        return len(self.set) == 0
+        return len(self.priorities) == 0
 
 
 def lnd_weight(policy: Dict[str, int], amount: int, prev_weight: int) -> Tuple[int, int]:
@@ -96,6 +94,25 @@ def lnd_weight(policy: Dict[str, int], amount: int, prev_weight: int) -> Tuple[i
     return amount + fee, weight
 
 
+def lnd_weights(compiled_graph: CompiledChannelGraph, slots: np.ndarray, amount, prev_weight):
+    """
+    The vectorized version of lnd_weight, calculating the weights of many half-channels
+    that transfer money to the same node at once.
+
+    :param compiled_graph: The compiled graph describing the network.
+    :param slots: The half-channels transferring money to node2 (they all share the same receiver).
+    :param amount: The amount of money to be transferred to node2.
+    :param prev_weight: The weight of the path from node2 to the target node.
+
+    :return: A tuple containing two arrays:
+                 (1) The amount of money each sender needs to receive for transferring the money forwards.
+                 (2) The weight of the route starting at each sender and reaching 'target' eventually.
+    """
+    fee = compiled_graph.base_fee[slots] + np.floor(amount * compiled_graph.proportional_fee[slots])
+    weight = np.round(prev_weight + amount * compiled_graph.time_lock_delta[slots] * RISK_FACTOR_BILLIONTHS + fee)
+    return amount + fee, weight
+
+
 def get_route(graph: nx.MultiGraph, source_id, target_id, amount: int, max_hops: int = 20):
     """
     Given a target node and a list of nodes, compute the route from any node in the list to the target node.
@@ -111,26 +128,83 @@ def get_route(graph: nx.MultiGraph, source_id, target_id, amount: int, max_hops:
 
     :return: A triplet representing the selected route:
                  (1) The path starting from this node to the target node (a list of edges).
+                 The graph itself is not changed, so concurrent queries can share it.
+    """
+    record_edge = list()
+    record_rest = list()
+
+    for node_id, record in _backwards_dijkstra(graph, target_id, amount, max_hops, record_edge, record_rest):
+        # If the popped node is the source node, we can finish and return the path it has,
+        # because we know this path is the path with minimal weight among all paths
+        # that start in 'source' and end in 'target'.
+        if node_id == source_id:
+            return _reconstruct_path(record_edge, record_rest, record)
+
+    return None  # No route was found transferring 'amount' from 'source' to 'target'.
+
+
+def get_routes_to_target(graph: nx.MultiGraph, target_id, amount: int, sources=None, max_hops: int = 20) -> Dict:
+    """
+    Compute the routes from many source nodes to the same target node, using a single 'backwards-Dijkstra'.
+    Each route is identical to the one get_route would return for the same source, target and amount.
+
+    :param graph: The graph describing the network.
+    :param target_id: The target node.
+    :param amount: Amount (in milli-satoshis) to transfer.
+    :param sources: The source nodes to compute routes for. If it's None, all of the nodes except the target.
+    :param max_hops: Maximal number of intermediate nodes in the route.
+
+    :return: A dictionary mapping each source node to its route to the target node (a list of edges),
+             or to None if no route was found.
+    """
+    if sources is None:
+        sources = [node for node in graph.nodes if node != target_id]
+
+    routes = dict.fromkeys(sources)
+    remaining_sources = set(sources)
+    record_edge = list()
+    record_rest = list()
+
+    for node_id, record in _backwards_dijkstra(graph, target_id, amount, max_hops, record_edge, record_rest):
+        if node_id in remaining_sources:
+            routes[node_id] = _reconstruct_path(record_edge, record_rest, record)
+            remaining_sources.remove(node_id)
+            if len(remaining_sources) == 0:
+                break
+
+    return routes
+
+
+def _backwards_dijkstra(graph: nx.MultiGraph, target_id, amount: int, max_hops: int,
+                        record_edge: List, record_rest: List):
+    """
+    Run the 'backwards-Dijkstra' from the target node, yielding the nodes in the order they are popped.
+
+    :param graph: The graph describing the network.
+    :param target_id: The target node.
+    :param amount: Amount (in milli-satoshis) that should reach the target node.
+    :param max_hops: Maximal number of intermediate nodes in the route.
+    :param record_edge: An empty list, filled with the first edge of the path of each record.
+    :param record_rest: An empty list, filled with the record of the rest of the path of each record.
+
+    :return: A generator of tuples (node, record), where record describes the path from the node to the target
+             (use _reconstruct_path to get it as a list of edges).
     """
-    # Initialize the 'amount_node_needs' and 'weight' attributes of each node as INFINITY.
+    # The 'amount_node_needs' and 'weight' of each node that was reached so far (nodes not in them are INFINITY).
     # These values will be changed during the run of the routing algorithm.
-    nx.set_node_attributes(graph, np.inf, 'amount_node_needs')
-    nx.set_node_attributes(graph, np.inf, 'weight')
+    amount_node_needs = {target_id: amount}  # The amount 'target' needs to get is the given 'amount'.
+    weights = {target_id: 0}                 # The weight of the path starting and ending in 'target' is 0.
 
-    # Initialize 'path_to_target' for each node in the graph - it's a list containing the path from it to 'target'.
-    # Note that we can't use set_node_attributes with mutable types like a list
-    # (as this list will be shared among all nodes which is undesirable).
-    for node in graph.nodes:
-        graph.nodes[node]['path_to_target'] = list()
+    # Instead of copying the whole path to 'target' for each node, the paths are kept as linked records:
+    # record i is the first edge of a path together with the record of the rest of this path (-1 if it's empty).
+    # Extending a path is then O(1), and a route is reconstructed only when it's needed by following the records.
+    path_record = {target_id: -1}
+    hops = {target_id: 0}
 
     unvisited_nodes = UpdatablePrioritySet()
 
-    # Initialize the target attributes with its desired values.
-    graph.nodes[target_id]['amount_node_needs'] = amount  # The amount 'target' needs to get is the given 'amount'.
-    graph.nodes[target_id]['weight'] = 0                  # The weight of the path starting and ending in 'target' is 0.
-
     # Add the target node to the unvisited_nodes data-structure with weight 0.
-    unvisited_nodes.update(target_id, None, 0)
+    unvisited_nodes.update(target_id, 0)
 
     # Iterate as long as there is some unvisited nodes we need to visit.
     while not unvisited_nodes.is_empty():
@@ -141,40 +215,218 @@ def get_route(graph: nx.MultiGraph, source_id, target_id, amount: int, max_hops:
         # that's why it's named 'receiver_node'.
         receiver_node_id = unvisited_nodes.pop()
 
-        # If the receiver node is the source node, we can finish and return the path it has,
-        # because we know this path is the path with minimal weight among all paths
-        # that start in 'source' and end in 'target'.
-        if receiver_node_id == source_id:
-            return graph.nodes[source_id]['path_to_target']
+        yield receiver_node_id, path_record[receiver_node_id]
+
+        receiver_amount = amount_node_needs[receiver_node_id]
+        receiver_weight = weights[receiver_node_id]
+        receiver_hops = hops[receiver_node_id]
 
         # Go over all the neighbors of this receiver node, and for each one the weight in the heap might need updating.
         receiver_node_edges = graph.edges(receiver_node_id, data=True)
         for _, _, edge_data in receiver_node_edges:
             sender_node_policy, sender_node_id = utils.common.get_sender_policy_and_id(receiver_node_id, edge_data)
-            edge_key = (sender_node_id, receiver_node_id, edge_data['channel_id'])
 
             # Calculate the weight of the path starting at 'sender' and ending at 'target',
             # passing first through the current 'receiver' (and continuing to target from there).
             # The amount that 'sender' needs to get in order to perform this multi-hop transfer is also calculated.
             amount_sender_needs, weight = lnd_weight(sender_node_policy,
-                                                     amount=graph.nodes[receiver_node_id]['amount_node_needs'],
-                                                     prev_weight=graph.nodes[receiver_node_id]['weight'])
-
-            sender_node_data = graph.nodes[sender_node_id]
-            receiver_node_data = graph.nodes[receiver_node_id]
+                                                     amount=receiver_amount,
+                                                     prev_weight=receiver_weight)
 
             # If the weight of the path starting at the neighbor and passing through the receiver_node is lower than
             # the current weight of the path that is saved for the neighbor.
-            if weight < sender_node_data['weight']:
+            if weight < weights.get(sender_node_id, np.inf):
                 # Update the weight of the path in the heap accordingly, since it's lower.
                 # Do not add to the unvisited nodes data-structure the new path if it's too long.
                 # Minus 1 because path is a list of edges and not a list of nodes, and #edges = #nodes + 1.
-                if len(receiver_node_data['path_to_target']) < max_hops - 1:
-                    unvisited_nodes.update(sender_node_id, sender_node_data['weight'], new_priority=weight)
+                if receiver_hops < max_hops - 1:
+                    unvisited_nodes.update(sender_node_id, new_priority=weight)
 
-                # Update the attributes of the node in the graph itself, to use in later iterations.
-                sender_node_data['weight'] = weight
-                sender_node_data['amount_node_needs'] = amount_sender_needs
-                sender_node_data['path_to_target'] = [edge_key] + receiver_node_data['path_to_target']
+                # Update the attributes of the node, to use in later iterations.
+                weights[sender_node_id] = weight
+                amount_node_needs[sender_node_id] = amount_sender_needs
+                record_edge.append((sender_node_id, receiver_node_id, edge_data['channel_id']))
+                record_rest.append(path_record[receiver_node_id])
+                path_record[sender_node_id] = len(record_edge) - 1
+                hops[sender_node_id] = receiver_hops + 1
 
-    return None  # No route was found transferring 'amount' from 'source' to 'target'.
+
+def _reconstruct_path(record_edge: List, record_rest: List, record: int) -> List:
+    """
+    :param record_edge: The first edge of the path described by each record.
+    :param record_rest: The record describing the rest of the path of each record (-1 if it's empty).
+    :param record: The record of the path to reconstruct.
+    :return: The path described by the given record (a list of edges).
+    """
+    path = list()
+    while record != -1:
+        path.append(record_edge[record])
+        record = record_rest[record]
+    return path
+
+
+class LNDRouter:
+    """
+    Answers route queries with the same 'backwards-Dijkstra' as get_route, running over the arrays of a
+    CompiledChannelGraph instead of the networkx dictionaries.
+
+    The router never changes the compiled graph - the state of a query is kept in scratch buffers owned by the router.
+    These buffers are allocated once (sized to the graph) and reused across queries, and only the entries that were
+    touched by a query are reset before the next one.
+    So many routers (e.g. one per thread or process) can answer queries over the same read-only compiled graph.
+    """
+
+    def __init__(self, compiled_graph: CompiledChannelGraph):
+        """
+        :param compiled_graph: The compiled graph describing the network.
+        """
+        n = compiled_graph.n_nodes
+        self.compiled_graph = compiled_graph
+        self.amount_node_needs = np.full(n, np.inf)
+        self.weights = np.full(n, np.inf)
+        # The paths to 'target' are kept as linked records of slots, exactly like in get_route.
+        self.path_record = np.full(n, -1, dtype=np.int64)
+        self.hops = np.zeros(n, dtype=np.int64)
+        # The nodes whose entries in the buffers were changed by the last query.
+        self.touched_nodes = list()
+
+    def _reset(self):
+        """
+        Reset the entries of the scratch buffers that were changed by the last query.
+        """
+        touched_nodes = self.touched_nodes
+        self.amount_node_needs[touched_nodes] = np.inf
+        self.weights[touched_nodes] = np.inf
+        self.path_record[touched_nodes] = -1
+        self.hops[touched_nodes] = 0
+        self.touched_nodes = list()
+
+    def get_route(self, source: int, target: int, amount: int, max_hops: int = 20, check_balances: bool = False):
+        """
+        :param source: The index of the source node.
+        :param target: The index of the target node.
+        :param amount: Amount (in milli-satoshis) to transfer.
+                       Note that this is the amount of money that should reach the target node eventually,
+                       and more money will be added in order to pay the fees on the route.
+        :param max_hops: Maximal number of intermediate nodes in the route.
+        :param check_balances: If it's True, skip the half-channels that do not have enough balance
+                               (at the moment) to transfer the amount they need to.
+
+        :return: An array of slots (half-channels) describing the path from the source node to the target node,
+                 or None if no route was found.
+        """
+        record_slot = list()
+        record_rest = list()
+
+        for node, record in self._backwards_dijkstra(target, amount, max_hops, record_slot, record_rest,
+                                                     check_balances):
+            if node == source:
+                return np.array(_reconstruct_path(record_slot, record_rest, record), dtype=np.int64)
+
+        return None  # No route was found transferring 'amount' from 'source' to 'target'.
+
+    def get_routes_to_target(self, target: int, amount: int, sources=None, max_hops: int = 20) -> Dict:
+        """
+        Compute the routes from many source nodes to the same target node, using a single 'backwards-Dijkstra'.
+        Each route is identical to the one get_route would return for the same source, target and amount.
+
+        :param target: The index of the target node.
+        :param amount: Amount (in milli-satoshis) to transfer.
+        :param sources: The indices of the source nodes. If it's None, all of the nodes except the target.
+        :param max_hops: Maximal number of intermediate nodes in the route.
+
+        :return: A dictionary mapping each source node to its route to the target node (an array of slots),
+                 or to None if no route was found.
+        """
+        if sources is None:
+            sources = [node for node in range(self.compiled_graph.n_nodes) if node != target]
+
+        routes = dict.fromkeys(sources)
+        remaining_sources = set(sources)
+        record_slot = list()
+        record_rest = list()
+
+        for node, record in self._backwards_dijkstra(target, amount, max_hops, record_slot, record_rest):
+            if node in remaining_sources:
+                routes[node] = np.array(_reconstruct_path(record_slot, record_rest, record), dtype=np.int64)
+                remaining_sources.remove(node)
+                if len(remaining_sources) == 0:
+                    break
+
+        return routes
+
+    def _backwards_dijkstra(self, target: int, amount: int, max_hops: int, record_slot: List, record_rest: List,
+                            check_balances: bool = False):
+        """
+        Run the 'backwards-Dijkstra' from the target node, yielding the nodes in the order they are popped.
+
+        :param target: The index of the target node.
+        :param amount: Amount (in milli-satoshis) that should reach the target node.
+        :param max_hops: Maximal number of intermediate nodes in the route.
+        :param record_slot: An empty list, filled with the first slot of the path of each record.
+        :param record_rest: An empty list, filled with the record of the rest of the path of each record.
+        :param check_balances: If it's True, skip the half-channels that do not have enough balance to transfer
+                               the amount their sender needs.
+
+        :return: A generator of tuples (node, record), where record describes the path from the node to the target.
+        """
+        self._reset()
+
+        compiled_graph = self.compiled_graph
+        amount_node_needs, weights, path_record, hops = self.amount_node_needs, self.weights, self.path_record, self.hops
+        touched_nodes = self.touched_nodes
+
+        unvisited_nodes = UpdatablePrioritySet()
+
+        amount_node_needs[target] = amount
+        weights[target] = 0
+        touched_nodes.append(target)
+        unvisited_nodes.update(target, 0)
+
+        while not unvisited_nodes.is_empty():
+            receiver = unvisited_nodes.pop()
+
+            yield receiver, path_record[receiver]
+
+            slots = compiled_graph.incoming_slots(receiver)
+            amounts_senders_need, senders_weights = lnd_weights(compiled_graph, slots,
+                                                                amount=amount_node_needs[receiver],
+                                                                prev_weight=weights[receiver])
+
+            # Filter the half-channels that improve the weight of their sender in one vectorized comparison,
+            # and then go over the (few) remaining ones in order, exactly like get_route does.
+            senders = compiled_graph.slot_sender[slots]
+            improving = senders_weights < weights[senders]
+            if check_balances:
+                improving &= compiled_graph.balance[slots] >= amounts_senders_need
+            for i in np.flatnonzero(improving):
+                sender, weight = int(senders[i]), senders_weights[i]
+                if weight < weights[sender]:
+                    if hops[receiver] < max_hops - 1:
+                        unvisited_nodes.update(sender, new_priority=weight)
+
+                    weights[sender] = weight
+                    amount_node_needs[sender] = amounts_senders_need[i]
+                    record_slot.append(slots[i])
+                    record_rest.append(path_record[receiver])
+                    path_record[sender] = len(record_slot) - 1
+                    hops[sender] = hops[receiver] + 1
+                    touched_nodes.append(sender)
+
+
+def get_compiled_route(compiled_graph: CompiledChannelGraph, source: int, target: int, amount: int,
+                       max_hops: int = 20):
+    """
+    Compute a single route over a compiled graph (see LNDRouter.get_route).
+    Prefer holding an LNDRouter when answering many queries, to reuse its buffers.
+
+    :param compiled_graph: The compiled graph describing the network.
+    :param source: The index of the source node.
+    :param target: The index of the target node.
+    :param amount: Amount (in milli-satoshis) to transfer.
+    :param max_hops: Maximal number of intermediate nodes in the route.
+
+    :return: An array of slots (half-channels) describing the path from the source node to the target node,
+             or None if no route was found.
+    """
+    return LNDRouter(compiled_graph).get_route(source, target, amount, max_hops)
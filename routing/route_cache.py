@@ -0,0 +1,196 @@
+import copy
+import heapq
+from typing import Dict
+
+# Returned by RouteCache.get for keys that are not in the cache
+# (None can not be used for that, since it's cached for pairs of nodes without a route).
+MISSING = object()
+
+
+class RouteCache:
+    """
+    A cache of the routes of the simulator, keyed by (source, target).
+
+    The cache can be bounded (see max_size), in which case this class evicts the route that was inserted first,
+    and the subclasses implement other eviction policies.
+    The cache can also invalidate the route of a pair of nodes after the transfers over it failed
+    max_consecutive_failures times in a row (e.g. because a channel on it was depleted),
+    so the simulator can route the pair again.
+    """
+
+    def __init__(self, max_size: int = None, max_consecutive_failures: int = None):
+        """
+        :param max_size: The maximal number of routes in the cache, or None for an unbounded cache.
+        :param max_consecutive_failures: The number of consecutive failed transfers after which a route is invalidated,
+                                         or None to never invalidate routes.
+        """
+        self.max_size = max_size
+        self.max_consecutive_failures = max_consecutive_failures
+        self.routes = dict()
+        self.consecutive_failures = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __contains__(self, key):
+        return key in self.routes
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, key, default=MISSING):
+        """
+        :return: The route of the given key, or default if it's not in the cache.
+        """
+        route = self.routes.get(key, MISSING)
+        if route is MISSING:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._on_access(key)
+        return route
+
+    def put(self, key, route):
+        """
+        Insert (or update) the route of the given key, evicting a route if the cache is full.
+        """
+        if key not in self.routes and self.max_size is not None and len(self.routes) >= self.max_size:
+            self._remove(self._get_key_to_evict())
+            self.evictions += 1
+
+        self.routes[key] = route
+        self._on_insert(key)
+
+    def record_transfer(self, key, succeeded: bool) -> bool:
+        """
+        Record the result of a transfer over the route of the given key.
+        The route might have been evicted since it was taken from the cache (e.g. by the routes put later in the same
+        batch of the simulator), in which case only the failure is counted.
+
+        :return: True if the route was invalidated because of this (failed) transfer.
+        """
+        if succeeded:
+            if self.max_consecutive_failures is not None:
+                self.consecutive_failures.pop(key, None)
+            return False
+
+        self.failures += 1
+        if self.max_consecutive_failures is None or key not in self.routes:
+            return False
+
+        consecutive_failures = self.consecutive_failures.get(key, 0) + 1
+        if consecutive_failures < self.max_consecutive_failures:
+            self.consecutive_failures[key] = consecutive_failures
+            return False
+
+        self._remove(key)
+        self.invalidations += 1
+        return True
+
+    def get_statistics(self) -> Dict:
+        """
+        :return: A dictionary with the counters of the cache.
+        """
+        return {'size': len(self.routes), 'hits': self.hits, 'misses': self.misses, 'failures': self.failures,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
+    def copy(self) -> 'RouteCache':
+        """
+        :return: A copy of the cache that can be changed independently (the routes themselves are shared).
+        """
+        route_cache = copy.copy(self)
+        route_cache.routes = self.routes.copy()
+        route_cache.consecutive_failures = self.consecutive_failures.copy()
+        return route_cache
+
+    def _remove(self, key):
+        self.routes.pop(key, None)
+        self.consecutive_failures.pop(key, None)
+
+    def _on_access(self, key):
+        pass
+
+    def _on_insert(self, key):
+        pass
+
+    def _get_key_to_evict(self):
+        # Dictionaries keep the insertion order, so the first key is the one that was inserted first.
+        return next(iter(self.routes))
+
+
+class LRURouteCache(RouteCache):
+    """
+    A route cache that evicts the least recently used route.
+    """
+
+    def _on_access(self, key):
+        # Move the key to the end of the dictionary.
+        self.routes[key] = self.routes.pop(key)
+
+
+class LFURouteCache(RouteCache):
+    """
+    A route cache that evicts the least frequently used route (and the least recently inserted one among those).
+    The frequencies are kept in a heap with lazy deletion, so each operation is O(log(max_size)).
+    """
+
+    def __init__(self, max_size: int = None, max_consecutive_failures: int = None):
+        super(LFURouteCache, self).__init__(max_size, max_consecutive_failures)
+        self.frequencies = dict()
+        self.heap = list()
+        self.insertions = 0
+
+    def copy(self) -> 'LFURouteCache':
+        route_cache = super(LFURouteCache, self).copy()
+        route_cache.frequencies = self.frequencies.copy()
+        route_cache.heap = self.heap.copy()
+        return route_cache
+
+    def _remove(self, key):
+        super(LFURouteCache, self)._remove(key)
+        self.frequencies.pop(key, None)
+
+    def _on_access(self, key):
+        self.frequencies[key] += 1
+        self._push(key)
+
+    def _on_insert(self, key):
+        self.frequencies[key] = self.frequencies.get(key, 0) + 1
+        self._push(key)
+
+    def _push(self, key):
+        self.insertions += 1
+        heapq.heappush(self.heap, (self.frequencies[key], self.insertions, key))
+
+        # Drop the outdated entries once they are the majority of the heap, so it does not grow with the accesses.
+        if len(self.heap) > 2 * len(self.frequencies) + 1:
+            self.heap = [(frequency, insertion, key) for frequency, insertion, key in self.heap
+                         if self.frequencies.get(key) == frequency]
+            heapq.heapify(self.heap)
+
+    def _get_key_to_evict(self):
+        # Skip the outdated entries of the heap (of keys that were removed or used again since they were pushed).
+        while True:
+            frequency, _, key = heapq.heappop(self.heap)
+            if self.frequencies.get(key) == frequency:
+                return key
+
+
+ROUTE_CACHES = {'fifo': RouteCache, 'lru': LRURouteCache, 'lfu': LFURouteCache}
+
+
+def create_route_cache(eviction: str = 'lru', max_size: int = None, max_consecutive_failures: int = None):
+    """
+    :param eviction: The eviction policy of the cache, one of ROUTE_CACHES.
+    :param max_size: The maximal number of routes in the cache, or None for an unbounded cache.
+    :param max_consecutive_failures: The number of consecutive failed transfers after which a route is invalidated,
+                                     or None to never invalidate routes.
+    :return: The route cache.
+    """
+    if eviction not in ROUTE_CACHES:
+        raise ValueError(f"Unknown eviction policy {eviction}, should be one of {list(ROUTE_CACHES)}")
+    return ROUTE_CACHES[eviction](max_size, max_consecutive_failures)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+import pytest
+
+# The modules of the repository are imported from its root (like the scripts in it do).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def create_lightning_graph(n_nodes: int = 40, n_channels: int = 120, max_capacity: int = 10 ** 5,
+                           seed: int = 0) -> nx.MultiGraph:
+    """
+    :return: A random lightning graph, with the attributes LN_parser.process_lightning_graph creates
+             (including the dummy balances).
+    """
+    rng = np.random.default_rng(seed)
+    graph = nx.MultiGraph()
+    for i in range(n_nodes):
+        pub_key = f'node-{i}'
+        graph.add_node(pub_key, pub_key=pub_key, serial_number=i, total_capacity=0)
+
+    for c in range(n_channels):
+        node1, node2 = rng.choice(n_nodes, size=2, replace=False)
+        node1_pub, node2_pub = f'node-{node1}', f'node-{node2}'
+        capacity = int(rng.integers(1, max_capacity))
+        node1_balance = float(rng.random() * capacity)
+        policies = [dict(fee_base_msat=float(rng.integers(0, 1000)), proportional_fee=float(rng.random() / 1000),
+                         time_lock_delta=int(rng.choice([14, 40, 144]))) for _ in range(2)]
+        graph.add_edge(node1_pub, node2_pub, str(c), channel_id=str(c), node1_pub=node1_pub, node2_pub=node2_pub,
+                       capacity=capacity, node1_policy=policies[0], node2_policy=policies[1],
+                       node1_balance=node1_balance, node2_balance=capacity - node1_balance)
+        graph.nodes[node1_pub]['total_capacity'] += capacity
+        graph.nodes[node2_pub]['total_capacity'] += capacity
+
+    return graph
+
+
+@pytest.fixture
+def lightning_graph():
+    return create_lightning_graph()
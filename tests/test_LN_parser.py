@@ -0,0 +1,27 @@
+import io
+import json
+
+import pytest
+
+from LightningGraph.LN_parser import iterate_json_arrays
+
+JSON_TEXTS = [
+    '{"x": 12.5, "nodes": [1]}',
+    '{"x": 1e5, "nodes": [1]}',
+    '{"x": -0.25E-3, "y": 123456789, "nodes": [1, 2.75, -3e2], "z": true, "edges": [{"a": 1.5}], "w": null}',
+    '{ "nodes" : [ 10 , 20.5 ] , "x" : 3.0 , "edges" : [ ] , "y" : false }',
+    '{"x": 7}',
+    '{}',
+]
+
+
+@pytest.mark.parametrize('text', JSON_TEXTS)
+def test_iterate_json_arrays_at_every_chunk_size(text):
+    expected = [(key, item) for key, value in json.loads(text).items() if isinstance(value, list) for item in value]
+    for chunk_size in range(1, len(text) + 1):
+        assert list(iterate_json_arrays(io.StringIO(text), chunk_size)) == expected, chunk_size
+
+
+def test_iterate_json_arrays_invalid_json():
+    with pytest.raises(json.JSONDecodeError):
+        list(iterate_json_arrays(io.StringIO('{"x": 12.5.1, "nodes": [1]}'), 1))
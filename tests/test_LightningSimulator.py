@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import LightningSimulator as LightningSimulator_module
+from LightningGraph.compiled_graph import CompiledChannelGraph
+from LightningSimulator import LightningSimulator
+from routing.LND_routing import LNDRouter
+from utils.common import LND_DEFAULT_POLICY
+from utils.frame_rendering import SimulationFramesPipeline
+from utils.workloads import UniformAmounts, UniformWorkload
+
+
+def test_amount_buckets(lightning_graph):
+    simulator = LightningSimulator(lightning_graph, num_transactions=1, transfer_amount=10 ** 4,
+                                   other_balance_proportion=1.0, amount_buckets_per_octave=4)
+    amounts = np.arange(1, 10 ** 5)
+    bucket_amounts = np.array([simulator.get_bucket_amount(bucket)
+                               for bucket in simulator.get_amount_buckets(amounts).tolist()])
+
+    assert simulator.get_bucket_amount(simulator.get_amount_buckets([10 ** 4])[0]) == 10 ** 4
+    # The amounts are rounded to the nearest bucket on a log scale (up to the rounding of the bucket amounts).
+    assert np.all(np.abs(np.log2(bucket_amounts / amounts)) <= 1 / 8 + 1e-9 + np.log2(1 + 1 / amounts))
+
+
+def test_variable_amounts_are_routed_per_bucket(lightning_graph):
+    simulator = LightningSimulator(lightning_graph, num_transactions=500, transfer_amount=10 ** 4,
+                                   other_balance_proportion=1.0, rng=np.random.default_rng(0),
+                                   workload=UniformWorkload(UniformAmounts(1, 10 ** 5)))
+    simulator.create_agent_node()
+    simulator.run()
+
+    router = LNDRouter(simulator.compiled_graph)
+    buckets = {amount_bucket for _, _, amount_bucket in simulator.route_memory.routes}
+    assert len(buckets) > 1
+    for (source, target, amount_bucket), route in list(simulator.route_memory.routes.items())[:200]:
+        expected_route = router.get_route(source, target, simulator.get_bucket_amount(amount_bucket))
+        if expected_route is None:
+            assert route is None
+        else:
+            assert route.slots.tolist() == expected_route.tolist()
+
+
+def test_failed_run_cancels_the_frames_pipeline(lightning_graph, tmp_path, monkeypatch):
+    simulator = LightningSimulator(lightning_graph, num_transactions=200, transfer_amount=10 ** 4,
+                                   other_balance_proportion=1.0, rng=np.random.default_rng(0))
+    simulator.create_agent_node()
+    pipelines = []
+
+    def create_pipeline(*args):
+        # A small queue of deltas, so the simulation waits for the rendering when it fails.
+        pipelines.append(SimulationFramesPipeline(*args, max_queued_deltas=2))
+        return pipelines[-1]
+
+    monkeypatch.setattr(LightningSimulator_module, 'SimulationFramesPipeline', create_pipeline)
+    transfer_priced_route = CompiledChannelGraph.transfer_priced_route
+    transfers = []
+
+    def failing_transfer_priced_route(compiled_graph, route):
+        transfers.append(route)
+        if len(transfers) == 20:
+            raise RuntimeError("transfer failed")
+        return transfer_priced_route(compiled_graph, route)
+
+    monkeypatch.setattr(CompiledChannelGraph, 'transfer_priced_route', failing_transfer_priced_route)
+
+    with pytest.raises(RuntimeError, match="transfer failed"):
+        simulator.run(plot_dir=str(tmp_path))
+
+    pipeline, = pipelines
+    assert pipeline.closed
+    assert not pipeline.thread.is_alive()
+    assert (tmp_path / "simulation.gif").exists()
+
+
+def test_add_edges_updates_the_total_capacities(lightning_graph):
+    simulator = LightningSimulator(lightning_graph, num_transactions=1, transfer_amount=10 ** 4,
+                                   other_balance_proportion=0.5)
+    agent = simulator.create_agent_node()
+    clone = simulator.clone()
+    node_total_capacity = simulator.get_node_total_capacity('node-0')
+
+    clone.add_edges([dict(node1_pub=agent, node2_pub=node, node1_policy=LND_DEFAULT_POLICY, node1_balance=10 ** 5)
+                     for node in ['node-0', 'node-1']])
+
+    assert clone.get_node_total_capacity(agent) == 3 * 10 ** 5
+    assert clone.get_node_total_capacity('node-0') == node_total_capacity + 1.5 * 10 ** 5
+    # The graph is shared with the base simulator, which does not have the agent's channels.
+    assert simulator.get_node_total_capacity(agent) == 0
+    assert simulator.get_node_total_capacity('node-0') == node_total_capacity
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from LightningSimulator import LightningSimulator
+from routing.LND_routing import LNDRouter
+from routing.route_cache import ROUTE_CACHES, create_route_cache
+from utils.common import LND_DEFAULT_POLICY
+
+
+@pytest.mark.parametrize('eviction', list(ROUTE_CACHES))
+@pytest.mark.parametrize('max_consecutive_failures', [1, 3])
+def test_simulator_with_bounded_cache_and_invalidation(lightning_graph, eviction, max_consecutive_failures):
+    # The cache is much smaller than the pairs of a batch, so routes are evicted before their transfers are recorded.
+    route_cache = create_route_cache(eviction, max_size=50, max_consecutive_failures=max_consecutive_failures)
+    simulator = LightningSimulator(lightning_graph, num_transactions=2000, transfer_amount=10 ** 4,
+                                   other_balance_proportion=1.0, batch_size=500, route_cache=route_cache,
+                                   rng=np.random.default_rng(0))
+    agent = simulator.create_agent_node()
+    simulator.add_edges([dict(node1_pub=agent, node2_pub=node, node1_policy=LND_DEFAULT_POLICY, node1_balance=10 ** 5)
+                         for node in ['node-0', 'node-1', 'node-2']])
+
+    agent_balance, _ = simulator.run()
+
+    statistics = route_cache.get_statistics()
+    assert len(agent_balance) == 2001
+    assert statistics['size'] <= 50
+    assert statistics['evictions'] > 0
+    assert statistics['failures'] > 0
+    assert statistics['invalidations'] > 0
+
+
+@pytest.mark.parametrize('eviction', list(ROUTE_CACHES))
+def test_record_transfer_of_evicted_route(eviction):
+    route_cache = create_route_cache(eviction, max_size=1, max_consecutive_failures=1)
+    route_cache.put((0, 1), 'route')
+    route_cache.put((1, 2), 'route')
+
+    assert not route_cache.record_transfer((0, 1), succeeded=False)
+    assert route_cache.record_transfer((1, 2), succeeded=False)
+    assert len(route_cache) == 0
+
+
+def test_unbounded_cache_keeps_rerouted_routes(lightning_graph):
+    simulator = LightningSimulator(lightning_graph, num_transactions=1, transfer_amount=10 ** 4,
+                                   other_balance_proportion=1.0)
+    compiled_graph = simulator.get_compiled_graph()
+    router = LNDRouter(compiled_graph)
+    rerouted_key = (1, 0, 0)
+    rerouted_route = simulator._route(router, 1, 0, simulator.transfer_amount, check_balances=True)
+    simulator.route_memory.put(rerouted_key, rerouted_route)
+
+    # Routing another pair with the same target computes the routes from all of the sources to it.
+    simulator._get_routes(router, [(2, 0, 0)])
+
+    assert simulator.route_memory.get(rerouted_key) is rerouted_route
+    assert (3, 0, 0) in simulator.route_memory
@@ -0,0 +1,19 @@
+import numpy as np
+from matplotlib import pyplot as plt
+
+from utils.metrics import MetricsRecorder
+from utils.visualizers import plot_experiment_mean_and_std
+
+
+def test_strided_results_are_plotted_over_the_transactions():
+    n_transactions, stride = 3000, 7
+    recorder = MetricsRecorder(n_transactions + 1, stride=stride)
+    results = {'agent': np.array([recorder.columns['agent_balance']] * 2)}
+    fig, ax = plt.subplots()
+
+    plot_experiment_mean_and_std(results, ax, stride=stride)
+
+    xs = ax.lines[0].get_xdata()
+    assert len(xs) == n_transactions // stride + 1
+    assert xs[-1] == (n_transactions // stride) * stride
+    plt.close(fig)
@@ -0,0 +1,80 @@
+import heapq
+import random
+from time import time
+
+import numpy as np
+
+import routing.LND_routing
+from LightningGraph.LN_parser import read_data_to_xgraph, process_lightning_graph
+from LightningGraph.compiled_graph import CompiledChannelGraph
+from routing.LND_routing import get_compiled_route, UpdatablePrioritySet
+from utils.graph_helpers import LIGHTNING_GRAPH_DUMP_PATH
+
+NUM_QUERIES = 200
+TRANSFER_AMOUNT = 10 ** 4
+REPS = 3
+
+
+class RemovingUpdatablePrioritySet:
+    """
+    The previous implementation of UpdatablePrioritySet, which removes the old entry from the heap on every update.
+    It's kept here (with the new interface) only to compare against it.
+    """
+    __slots__ = ('priorities', 'heap')
+
+    def __init__(self):
+        self.priorities = dict()
+        self.heap = list()
+
+    def update(self, node_id, new_priority):
+        if node_id in self.priorities:
+            self.heap.remove((self.priorities[node_id], node_id))  # O(n)
+            heapq.heapify(self.heap)  # O(n)
+        self.priorities[node_id] = new_priority
+        heapq.heappush(self.heap, (new_priority, node_id))
+
+    def pop(self):
+        node_id = heapq.heappop(self.heap)[1]
+        del self.priorities[node_id]
+        return node_id
+
+    def is_empty(self):
+        return len(self.priorities) == 0
+
+
+def time_queries(compiled_graph, queries, priority_set_class):
+    """
+    Run the given route queries using the given priority-set class in the backwards-Dijkstra.
+
+    :return: The average time of answering all of the queries, and the routes that were found.
+    """
+    routing.LND_routing.UpdatablePrioritySet = priority_set_class
+    times = list()
+    for rep in range(REPS):
+        start = time()
+        routes = [get_compiled_route(compiled_graph, source, target, TRANSFER_AMOUNT) for source, target in queries]
+        times.append(time() - start)
+    routing.LND_routing.UpdatablePrioritySet = UpdatablePrioritySet
+    return np.mean(times), routes
+
+
+def main():
+    graph = read_data_to_xgraph(LIGHTNING_GRAPH_DUMP_PATH)
+    process_lightning_graph(graph, remove_isolated=True, total_capacity=True)
+    compiled_graph = CompiledChannelGraph(graph)
+    print(f"Graph with {len(graph.nodes)} nodes and {len(graph.edges)} edges")
+
+    queries = [tuple(random.sample(range(compiled_graph.n_nodes), 2)) for _ in range(NUM_QUERIES)]
+
+    removing_time, removing_routes = time_queries(compiled_graph, queries, RemovingUpdatablePrioritySet)
+    lazy_time, lazy_routes = time_queries(compiled_graph, queries, UpdatablePrioritySet)
+
+    same_routes = sum((r1 is None and r2 is None) or (r1 is not None and np.array_equal(r1, r2))
+                      for r1, r2 in zip(removing_routes, lazy_routes))
+    print(f"Removing priority-set: {removing_time:.2f} sec for {NUM_QUERIES} queries")
+    print(f"Lazy-deletion priority-set: {lazy_time:.2f} sec for {NUM_QUERIES} queries")
+    print(f"Identical routes: {same_routes}/{NUM_QUERIES}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import networkx as nx
+
+POLICY_KEYS = ['fee_base_msat', 'proportional_fee', 'time_lock_delta']
+
+
+class LRUCache:
+    """
+    A dictionary with a maximal size, which evicts the least recently used item when it's full.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        """
+        :return: The value of the given key (and mark it as the most recently used), or default if it's missing.
+        """
+        if key not in self.items:
+            return default
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        """
+        Insert (or update) the given key, evicting the least recently used item if the cache is full.
+        """
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.items.pop(key, default)
+
+    def clear(self):
+        self.items.clear()
+
+
+def graph_fingerprint(graph: nx.MultiGraph) -> str:
+    """
+    Calculate a fingerprint of the parts of the graph that the routing depends on:
+    the nodes, the channels and the policies of the channels (but not the balances).
+
+    :param graph: The graph.
+    :return: A hex-string which is identical for graphs with identical nodes, channels and policies
+             (in the same order).
+    """
+    hasher = hashlib.sha1()
+    for node in graph.nodes:
+        hasher.update(repr(node).encode())
+
+    for _, _, edge_data in graph.edges(data=True):
+        channel = [edge_data['channel_id'], edge_data['node1_pub'], edge_data['node2_pub']]
+        for i in [1, 2]:
+            policy = edge_data[f'node{i}_policy']
+            channel.extend(policy[key] for key in POLICY_KEYS)
+        hasher.update(repr(channel).encode())
+
+    return hasher.hexdigest()
+
+
+def file_hash(path: str, chunk_size: int = 2 ** 20) -> str:
+    """
+    :param path: The path of a file.
+    :param chunk_size: The file is read in chunks of this size, so it's never loaded to the memory at once.
+    :return: The SHA-1 hex-digest of the contents of the file.
+    """
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def load_pickle(path: str):
+    """
+    :return: The object pickled in the given path, or None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_pickle(obj, path: str):
+    """
+    Pickle the given object to the given path.
+    The object is written to a temporary file which is then renamed,
+    so concurrent readers never see a partially written file.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(temp_path, path)
@@ -0,0 +1,251 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple
+
+import imageio
+import networkx as nx
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.pyplot import cm
+
+from utils.common import human_format
+
+"""
+    An asynchronous pipeline for rendering the frames of a simulation (see LightningSimulator.run).
+    The simulator only emits a lightweight FrameDelta for each step (the balances it changed and the route),
+    a background thread applies the deltas to its own copy of the balances and sends the frames to a pool of
+    worker processes, which draw them on top of a pre-drawn background of the static parts of the graph,
+    and the rendered frames are streamed (in the order of the steps) into a GIF / MP4 writer.
+"""
+
+FRAME_FIGURE_SIZE = (9, 9)
+FRAMES_PER_SECOND = 2
+
+
+class FrameDelta(NamedTuple):
+    """
+    The changes in a step of the simulation which are needed in order to render its frame.
+    """
+    step: int
+    # The slots whose balances changed in the step (the slots of the route and their reversed slots,
+    # if the transfer succeeded) and their new balances.
+    slots: np.ndarray
+    balances: np.ndarray
+    # The slots of the route of the step, ordered from the source to the target.
+    route_slots: np.ndarray
+    # The index of the first slot in the route that wasn't able to transfer the funds (len(route_slots) if none).
+    last_node_index: int
+
+
+class FrameScene(NamedTuple):
+    """
+    The static parts of the frames of a simulation.
+    """
+    node_ids: List
+    # The position (x, y) and the label (serial number) of each node.
+    positions: Dict
+    node_labels: Dict
+    # The (node1, node2, channel id) of each channel, in the order of the channels of the compiled graph
+    # (i.e. channel c has the slots 2*c and 2*c+1, see CompiledChannelGraph).
+    channels: List[Tuple]
+
+
+class FrameRenderer:
+    """
+    Renders the frames of a scene. The nodes, the channels and the labels of the nodes are drawn once,
+    and each frame restores this background and draws only the balances of the channels and the route on top of it
+    (and the nodes again, since they are drawn above the balances and the route).
+    """
+
+    def __init__(self, scene: FrameScene):
+        self.scene = scene
+        self.graph = nx.MultiGraph()
+        self.graph.add_nodes_from(scene.node_ids)
+        self.graph.add_edges_from(scene.channels)
+        # Whether node1 is on the left of node2 in each channel (the balance of the left node is written first).
+        self.is_node1_left = [scene.positions[node1][0] < scene.positions[node2][0]
+                              for node1, node2, _ in scene.channels]
+
+        # The figure is not created with pyplot, so the rendering does not depend on its global state (and backend).
+        self.figure = Figure(figsize=FRAME_FIGURE_SIZE)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        nx.draw_networkx_edges(self.graph, scene.positions, ax=self.ax)
+        self.foreground = [nx.draw_networkx_nodes(self.graph, scene.positions, ax=self.ax, node_color='k',
+                                                  node_size=400)]
+        self.foreground += nx.draw_networkx_labels(self.graph, scene.positions, labels=scene.node_labels, ax=self.ax,
+                                                   font_color='y', font_size=6).values()
+        # The layout is made with a title, which is drawn in each frame (so it's not part of the background).
+        self.ax.set_title("step")
+        self.figure.tight_layout()
+        self.ax.set_title("")
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def get_edge_labels(self, balances: np.ndarray) -> Dict:
+        """
+        :param balances: The balance of each slot.
+        :return: The labels of the balances of the channels, "<left node balance> : <right node balance>".
+        """
+        balances = balances.tolist()
+        edge_labels = dict()
+        for c, ((node1, node2, _), is_node1_left) in enumerate(zip(self.scene.channels, self.is_node1_left)):
+            node1_balance, node2_balance = human_format(balances[2 * c]), human_format(balances[2 * c + 1])
+            if is_node1_left:
+                edge_labels[(node1, node2)] = f"{node1_balance} : {node2_balance}"
+            else:
+                edge_labels[(node1, node2)] = f"{node2_balance} : {node1_balance}"
+        return edge_labels
+
+    def slot_to_edge(self, slot: int) -> Tuple:
+        """
+        :return: The (sender, receiver, channel id) of the given slot.
+        """
+        node1, node2, channel_id = self.scene.channels[slot >> 1]
+        return (node1, node2, channel_id) if slot % 2 == 0 else (node2, node1, channel_id)
+
+    def render(self, step: int, balances: np.ndarray, route_slots: np.ndarray, last_node_index: int) -> np.ndarray:
+        """
+        :return: The frame of the given state of the simulation, as an RGB image array.
+        """
+        self.canvas.restore_region(self.background)
+        artists = list(nx.draw_networkx_edge_labels(self.graph, self.scene.positions, ax=self.ax,
+                                                    edge_labels=self.get_edge_labels(balances),
+                                                    font_color='red', font_size=7).values())
+
+        # Highlight the route, the part that transferred the money wider than the rest.
+        route = [self.slot_to_edge(slot) for slot in route_slots.tolist()]
+        color = cm.rainbow(np.linspace(0, 1, 1))[0]
+        for edge_list, width in [(route[:last_node_index], 15), (route[last_node_index:], 5)]:
+            if len(edge_list) > 0:
+                edges = nx.draw_networkx_edges(self.graph, self.scene.positions, ax=self.ax, edgelist=edge_list,
+                                               edge_color=[color], width=width, alpha=0.5)
+                # The edges of a multigraph are drawn as a list of patches, and otherwise as a single collection.
+                artists.extend(edges if isinstance(edges, list) else [edges])
+
+        # Mark src and dest positions
+        for node, text in [(route[0][0], 'source'), (route[-1][1], 'target')]:
+            x, y = self.scene.positions[node]
+            artists.append(self.ax.text(x, y, s=text, bbox=dict(facecolor=color, alpha=0.5)))
+
+        self.ax.set_title(f"step-{step}")
+        for artist in sorted(artists + self.foreground + [self.ax.title], key=lambda artist: artist.get_zorder()):
+            self.ax.draw_artist(artist)
+        frame = np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
+
+        for artist in artists:
+            artist.remove()
+        return frame
+
+
+# The renderer of a worker process (see SimulationFramesPipeline).
+_worker_renderer = None
+
+
+def _init_render_worker(scene: FrameScene):
+    global _worker_renderer
+    _worker_renderer = FrameRenderer(scene)
+
+
+def _render_frame_in_worker(frame):
+    return _worker_renderer.render(*frame)
+
+
+class SimulationFramesPipeline:
+    """
+    Renders the frames of a simulation in worker processes, while the simulation runs.
+    The simulator calls emit with the delta of each step it wants a frame of (which only puts it in a queue),
+    and close at the end of the simulation (which waits for the rest of the frames to be written),
+    or cancel if the simulation fails.
+    """
+
+    def __init__(self, scene: FrameScene, balances: np.ndarray, out_path: str, workers: int = 1,
+                 max_pending_frames: int = None, max_queued_deltas: int = None):
+        """
+        :param scene: The static parts of the frames.
+        :param balances: The balance of each slot when the simulation starts.
+        :param out_path: The path of the animation (a .gif, or any other format imageio can write, e.g. .mp4).
+        :param workers: The number of worker processes to render the frames with.
+        :param max_pending_frames: The maximal number of frames that are rendered (or waiting to be written) at once,
+                                   which bounds the memory of the pipeline. By default it's twice the workers.
+        :param max_queued_deltas: The maximal number of deltas that wait to be rendered. When there are more, emit
+                                  blocks until the rendering catches up (rather than letting the queue grow without
+                                  bound). By default it's 4 times max_pending_frames.
+        """
+        self.balances = balances.copy()
+        self.max_pending_frames = max_pending_frames if max_pending_frames is not None else 2 * workers
+        self.deltas = queue.Queue(maxsize=max_queued_deltas if max_queued_deltas is not None
+                                  else 4 * self.max_pending_frames)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker, initargs=(scene,))
+        # The GIF writer takes the duration of a frame (in ms), and the video writers take the frame rate.
+        frame_rate = dict(duration=1000 / FRAMES_PER_SECOND) if out_path.endswith('.gif') \
+            else dict(fps=FRAMES_PER_SECOND)
+        self.writer = imageio.get_writer(out_path, mode='I', **frame_rate)
+        self.error = None
+        self.closed = False
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._write_frames, daemon=True)
+        self.thread.start()
+
+    def emit(self, delta: FrameDelta):
+        """
+        Add a frame of the given step (the frames are rendered in the order they are emitted).
+        Blocks while the queue of the deltas is full.
+        """
+        if self.error is not None:
+            raise self.error
+        self.deltas.put(delta)
+
+    def close(self):
+        """
+        Wait for all of the frames to be rendered and written.
+        """
+        self.closed = True
+        self.deltas.put(None)
+        self.thread.join()
+        self.executor.shutdown(cancel_futures=True)
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        """
+        Stop rendering the frames without waiting for the rest of them, and close the writer (with the frames that
+        were written so far). Does nothing if the pipeline is already closed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.cancelled.set()
+        # The writing thread always keeps taking deltas from the queue, so this does not block for long.
+        self.deltas.put(None)
+        self.thread.join()
+        self.executor.shutdown(cancel_futures=True)
+
+    def _write_frames(self):
+        # The frames that are being rendered, in the order they should be written.
+        pending_frames = deque()
+        try:
+            while True:
+                delta = self.deltas.get()
+                if delta is None or self.cancelled.is_set():
+                    break
+                self.balances[delta.slots] = delta.balances
+                pending_frames.append(self.executor.submit(_render_frame_in_worker,
+                                                           (delta.step, self.balances.copy(), delta.route_slots,
+                                                            delta.last_node_index)))
+                if len(pending_frames) >= self.max_pending_frames:
+                    self.writer.append_data(pending_frames.popleft().result())
+
+            while len(pending_frames) > 0 and not self.cancelled.is_set():
+                self.writer.append_data(pending_frames.popleft().result())
+        except Exception as e:
+            self.error = e
+            # Keep taking the deltas until the pipeline is closed, so emit, close and cancel never block on a full
+            # queue (emit raises the error instead).
+            while self.deltas.get() is not None:
+                pass
+        finally:
+            self.writer.close()
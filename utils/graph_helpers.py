@@ -1,11 +1,30 @@
+import os
 import random
+from typing import Dict
 
 import networkx as nx
+import numpy as np
 
-from LightningGraph.LN_parser import read_data_to_xgraph, process_lightning_graph
+from LightningGraph.LN_parser import process_lightning_graph
+from LightningGraph.graph_snapshot import load_graph_snapshot
+from utils.caching import LRUCache, file_hash, graph_fingerprint, load_pickle, save_pickle
 
 LIGHTNING_GRAPH_DUMP_PATH = 'LightningGraph/old_dumps/LN_2020.05.13-08.00.01.json'
 
+# The processed sub graphs are cached on disk (by default next to the dump), see get_sub_graph_cache_path.
+# Bump the version whenever the processing of the sub graphs changes, so old cached sub graphs are not loaded.
+SUB_GRAPH_CACHE_VERSION = 1
+SUB_GRAPH_CACHE_DIR = None
+
+# The layouts of the graphs (for plotting) are slow to compute (quadratic in the number of nodes), so they are
+# computed only when needed and cached by the graph's fingerprint in memory.
+# Set POSITIONS_CACHE_DIR to a directory in order to persist the cache between runs as well.
+POSITIONS_CACHE_SIZE = 16
+POSITIONS_CACHE_DIR = None
+# The layout is seeded, so a cached layout is the same as a newly computed one.
+POSITIONS_SEED = 0
+_positions_cache = LRUCache(max_size=POSITIONS_CACHE_SIZE)
+
 
 def sample_long_route(graph, amount, get_route_func, min_route_length=4, max_trials=10000):
     """
@@ -31,30 +50,133 @@ def sample_long_route(graph, amount, get_route_func, min_route_length=4, max_tri
     return route, src, dest
 
 
-def create_sub_graph_by_node_capacity(dump_path=LIGHTNING_GRAPH_DUMP_PATH, k=64, highest_capacity_offset=0):
+def get_ordered_sub_graph(graph, nodes):
     """
-    Creates a sub graph with at most k nodes, selecting nodes by their total capacities.
+    Like graph.subgraph(nodes).copy(), but the nodes of the resulting graph are in the order of the given nodes
+    (the order of the subgraph view depends on the hashes of the nodes, which makes the results of the simulations
+    depend on the hash seed of the process).
 
-    :param dump_path: The path to the JSON describing the lightning graph dump.
-    :param k: The maximal number of nodes in the resulting graph.
-    :param highest_capacity_offset: If it's 0, takes the k nodes with the highest capacity.
-                                    If its m > 0, takes the k first nodes after the first m nodes.
-                                    This is used to get a less connected graph.
-                                    We can't take lowest nodes as removing high
-                                    nodes usually makes the graph highly unconnected.
-    :returns: a connected graph with at most k nodes
+    :param graph: The graph.
+    :param nodes: A list of nodes in the graph.
+    :return: A new graph induced by the given nodes, with copies of their attributes and of their edges' attributes.
     """
-    graph = read_data_to_xgraph(dump_path)
-    process_lightning_graph(graph, remove_isolated=True, total_capacity=True, infer_implementation=True)
+    nodes_set = set(nodes)
+    sub_graph = graph.__class__()
+    sub_graph.graph.update(graph.graph)
+    sub_graph.add_nodes_from((node, graph.nodes[node]) for node in nodes)
+    sub_graph.add_edges_from((node1, node2, key, data)
+                             for node1, node2, key, data in graph.edges(nodes, keys=True, data=True)
+                             if node1 in nodes_set and node2 in nodes_set)
+    return sub_graph
+
+
+def get_graph_positions(graph) -> Dict:
+    """
+    Calculate the positions of the nodes of the graph for plotting it (using networkx spring layout).
+    The result is cached by the graph's fingerprint, in memory and in POSITIONS_CACHE_DIR (if it's set).
+
+    :param graph: The graph.
+    :return: A dictionary mapping each node to its position (x, y).
+             Note that it might be shared with other callers, so it should not be modified.
+    """
+    cache_key = graph_fingerprint(graph)
+    cache_path = None if POSITIONS_CACHE_DIR is None else os.path.join(POSITIONS_CACHE_DIR,
+                                                                       f'positions-{cache_key}.pkl')
+    positions = _positions_cache.get(cache_key)
+    if positions is None and cache_path is not None:
+        positions = load_pickle(cache_path)
+    if positions is None:
+        positions = nx.spring_layout(graph, seed=POSITIONS_SEED)
+        if cache_path is not None:
+            save_pickle(positions, cache_path)
+
+    _positions_cache.put(cache_key, positions)
+    return positions
+
+
+def subtract_cut_channels_capacities(graph, sub_graph):
+    """
+    Update the total capacities of the nodes of the sub graph (copied from the graph) incrementally,
+    by subtracting the capacities of their channels to nodes outside of the sub graph,
+    instead of summing the capacities of all of their channels in the sub graph from scratch.
+
+    :param graph: The graph, processed with total_capacity=True.
+    :param sub_graph: A sub graph of the graph induced by some of its nodes.
+    """
+    node_index = {node: i for i, node in enumerate(sub_graph.nodes)}
+    # Each channel touching the sub graph appears once, with its node in the sub graph first.
+    cut_channels = [(node_index[node1], data['capacity'])
+                    for node1, node2, data in graph.edges(sub_graph.nodes, data=True) if node2 not in node_index]
+    cut_nodes, cut_capacities = np.array(cut_channels, dtype=np.int64).reshape(-1, 2).T
+    nodes_cut_capacities = np.bincount(cut_nodes, weights=cut_capacities, minlength=len(node_index)).astype(np.int64)
+    for node, node_cut_capacity in zip(sub_graph.nodes, nodes_cut_capacities.tolist()):
+        sub_graph.nodes[node]['total_capacity'] -= node_cut_capacity
+
+
+def get_sub_graph_cache_path(dump_path, k, highest_capacity_offset):
+    """
+    :return: The path of the cached sub graph of the given dump, k and offset (in SUB_GRAPH_CACHE_DIR or next
+             to the dump), which is keyed by the hash of the dump's contents and by SUB_GRAPH_CACHE_VERSION.
+    """
+    cache_dir = os.path.dirname(dump_path) if SUB_GRAPH_CACHE_DIR is None else SUB_GRAPH_CACHE_DIR
+    dump_name = os.path.splitext(os.path.basename(dump_path))[0]
+    return os.path.join(cache_dir, f'{dump_name}-{file_hash(dump_path)}-sub-graph-k{k}-offset{highest_capacity_offset}'
+                                   f'-v{SUB_GRAPH_CACHE_VERSION}.pkl')
+
+
+def _create_unbalanced_sub_graph(dump_path, k, highest_capacity_offset):
+    """
+    The part of create_sub_graph_by_node_capacity which does not depend on the random generator
+    (everything except the dummy balances).
+    """
+    graph = load_graph_snapshot(dump_path).to_xgraph()
+    # The dummy balances are drawn only for the channels of the sub graph.
+    process_lightning_graph(graph, remove_isolated=True, total_capacity=True, infer_implementation=True,
+                            add_dummy_balances=False)
 
     sorted_nodes = sorted(graph.nodes, key=lambda node: graph.nodes[node]['total_capacity'], reverse=True)
 
     # Can't take last nodes as removing highest capacity nodes makes most of them isolated
     best_nodes = sorted_nodes[highest_capacity_offset: k + highest_capacity_offset]
-    graph = graph.subgraph(best_nodes).copy()  # without copy a view is returned and the graph can not be changed.
+    sub_graph = get_ordered_sub_graph(graph, best_nodes)
+    subtract_cut_channels_capacities(graph, sub_graph)
 
     # This may return a graph with less than k nodes
-    process_lightning_graph(graph, remove_isolated=True, total_capacity=True)
-    print(f"Creating sub graph with {len(graph.nodes)}/{len(sorted_nodes)} nodes and {len(graph.edges)} edges")
+    process_lightning_graph(sub_graph, remove_isolated=True, add_dummy_balances=False)
+    print(f"Creating sub graph with {len(sub_graph.nodes)}/{len(sorted_nodes)} nodes and {len(sub_graph.edges)} edges")
+
+    return sub_graph
+
 
-    return graph
+def create_sub_graph_by_node_capacity(dump_path=LIGHTNING_GRAPH_DUMP_PATH, k=64, highest_capacity_offset=0,
+                                      rng: np.random.Generator = None, use_cache: bool = True):
+    """
+    Creates a sub graph with at most k nodes, selecting nodes by their total capacities.
+
+    :param dump_path: The path to the JSON describing the lightning graph dump
+                      (it is parsed once, and then loaded from its snapshot, see LightningGraph.graph_snapshot).
+    :param k: The maximal number of nodes in the resulting graph.
+    :param highest_capacity_offset: If it's 0, takes the k nodes with the highest capacity.
+                                    If its m > 0, takes the k first nodes after the first m nodes.
+                                    This is used to get a less connected graph.
+                                    We can't take lowest nodes as removing high
+                                    nodes usually makes the graph highly unconnected.
+    :param rng: The random generator of the dummy balances (by default a new one, seeded from the OS).
+    :param use_cache: If True, the sub graph (processed, but without the dummy balances) is loaded from its cache
+                      file (see get_sub_graph_cache_path), or created and saved to it if it does not exist yet.
+                      The dummy balances are drawn after loading it, so the result is the same as without the cache.
+    :returns: a connected graph with at most k nodes
+    """
+    if use_cache:
+        cache_path = get_sub_graph_cache_path(dump_path, k, highest_capacity_offset)
+        sub_graph = load_pickle(cache_path)
+        if sub_graph is None:
+            sub_graph = _create_unbalanced_sub_graph(dump_path, k, highest_capacity_offset)
+            save_pickle(sub_graph, cache_path)
+        else:
+            print(f"Loading sub graph with {len(sub_graph.nodes)} nodes and {len(sub_graph.edges)} edges")
+    else:
+        sub_graph = _create_unbalanced_sub_graph(dump_path, k, highest_capacity_offset)
+
+    process_lightning_graph(sub_graph, rng=rng)
+    return sub_graph
@@ -0,0 +1,90 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+
+# The columns the simulator can record for each step, and their types.
+# The step before the first transaction is recorded as well, so step i is the state after the i-th transaction.
+METRICS_COLUMNS = {
+    # The total balance of the agent in its channels.
+    'agent_balance': np.float64,
+    # The cumulative number of successful transactions that were routed through the agent.
+    'routes_via_agent': np.int64,
+    # Whether the transaction succeeded.
+    'success': np.bool_,
+    # The number of hops (channels) in the route of the transaction (0 if there is no route).
+    'hops': np.int16,
+    # The fee the agent earned in the transaction.
+    'agent_fee': np.float64,
+    # The index of the hop that failed the transaction (-1 if it succeeded or if there is no route).
+    'failing_hop': np.int16,
+}
+
+# The columns that are needed for the results of the experiments.
+DEFAULT_METRICS_COLUMNS = ['agent_balance', 'routes_via_agent']
+
+
+class MetricsRecorder:
+    """
+    Records the metrics of a simulation run in preallocated NumPy columns, one row per recorded step.
+
+    Only every stride-th step is recorded, to keep long runs small.
+    The columns can be kept in memory, or written to .npy files in a directory (as memory-mapped arrays that are
+    flushed to the disk incrementally, so they can be loaded with np.load, also while the simulation runs).
+    """
+
+    def __init__(self, n_steps: int, columns: List[str] = None, stride: int = 1, out_dir: str = None):
+        """
+        :param n_steps: The number of steps in the run (including the step before the first transaction).
+        :param columns: The names of the columns to record (see METRICS_COLUMNS).
+                        The default is DEFAULT_METRICS_COLUMNS.
+        :param stride: Record only the steps that are divisible by the stride.
+        :param out_dir: If it's given, the columns are written to '<column>.npy' files in this directory.
+        """
+        if columns is None:
+            columns = DEFAULT_METRICS_COLUMNS
+        unknown_columns = set(columns) - set(METRICS_COLUMNS)
+        if len(unknown_columns) > 0:
+            raise ValueError(f"Unknown metrics columns {unknown_columns}, should be some of {list(METRICS_COLUMNS)}")
+
+        self.stride = stride
+        self.out_dir = out_dir
+        n_rows = (n_steps - 1) // stride + 1
+
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+        self.columns: Dict[str, np.ndarray] = {name: self._allocate_column(name, n_rows) for name in columns}
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def _allocate_column(self, name: str, n_rows: int) -> np.ndarray:
+        if self.out_dir is None:
+            return np.zeros(n_rows, dtype=METRICS_COLUMNS[name])
+        return np.lib.format.open_memmap(os.path.join(self.out_dir, f'{name}.npy'), mode='w+',
+                                         dtype=METRICS_COLUMNS[name], shape=(n_rows,))
+
+    def record_steps(self, first_step: int, **values):
+        """
+        Record the values of consecutive steps (only the steps that are divisible by the stride are kept).
+        Values of columns that are not recorded are ignored.
+
+        :param first_step: The first step of the given values.
+        :param values: The values of each column in the steps (sequences with the same length).
+        """
+        n_steps = len(next(iter(values.values())))
+        steps = np.arange(first_step, first_step + n_steps)
+        recorded = steps % self.stride == 0
+        rows = steps[recorded] // self.stride
+
+        for name, column in self.columns.items():
+            if name in values:
+                column[rows] = np.asarray(values[name])[recorded]
+
+    def flush(self):
+        """
+        Write the recorded rows to the disk (if the columns are written to a directory).
+        """
+        if self.out_dir is not None:
+            for column in self.columns.values():
+                column.flush()
@@ -0,0 +1,45 @@
+from typing import List
+
+import numpy as np
+
+# The keys of the random streams of an experiment, under its root SeedSequence (see get_child_seed_sequence).
+# The graph stream draws the dummy balances of the graph,
+# and the simulations stream has a child for each (agent, repeat) which is used by the agent and the simulator.
+GRAPH_STREAM = 0
+SIMULATIONS_STREAM = 1
+
+
+def get_root_seed_sequence(seed: int = None) -> np.random.SeedSequence:
+    """
+    :param seed: The seed of the experiment, or None to draw a fresh one from the OS
+                 (it can be reproduced later with the entropy of the returned SeedSequence).
+    :return: The root SeedSequence of the experiment, from which all of its random streams are derived.
+    """
+    return np.random.SeedSequence(seed)
+
+
+def get_child_seed_sequence(seed_sequence: np.random.SeedSequence, *key: int) -> np.random.SeedSequence:
+    """
+    Unlike SeedSequence.spawn, the child depends only on the given key (and not on the number of children that
+    were spawned before), so e.g. the stream of a repeat is the same regardless of the order or the process in which
+    the repeats run.
+
+    :param seed_sequence: The parent SeedSequence.
+    :param key: The key of the child, e.g. (SIMULATIONS_STREAM, agent index, repeat).
+    :return: The child SeedSequence of the given key.
+    """
+    return np.random.SeedSequence(seed_sequence.entropy, spawn_key=tuple(seed_sequence.spawn_key) + key)
+
+
+def get_child_rng(seed_sequence: np.random.SeedSequence, *key: int) -> np.random.Generator:
+    """
+    :return: A Generator of the child SeedSequence of the given key (see get_child_seed_sequence).
+    """
+    return np.random.default_rng(get_child_seed_sequence(seed_sequence, *key))
+
+
+def spawn_rngs(seed_sequence: np.random.SeedSequence, n: int) -> List[np.random.Generator]:
+    """
+    :return: n independent Generators spawned from the given SeedSequence.
+    """
+    return [np.random.default_rng(child) for child in seed_sequence.spawn(n)]
@@ -0,0 +1,299 @@
+import csv
+from itertools import islice
+from typing import Callable, Iterator, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from LightningGraph.compiled_graph import CompiledChannelGraph
+
+
+class TransactionsChunk(NamedTuple):
+    """
+    A chunk of consecutive transactions of a workload.
+    """
+    # The indices (in the compiled graph) of the source and the target nodes of each transaction.
+    sources: np.ndarray
+    targets: np.ndarray
+    # The amount each transaction transfers.
+    amounts: np.ndarray
+
+
+class UniformAmounts:
+    """
+    Amounts drawn uniformly from the integers in [min_amount, max_amount].
+    """
+
+    def __init__(self, min_amount: int, max_amount: int):
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+
+    def __call__(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        return rng.integers(self.min_amount, self.max_amount, size=n, endpoint=True)
+
+
+class LogNormalAmounts:
+    """
+    Heavy-tailed amounts - mostly small payments and a few large ones.
+    The logarithms of the amounts are normal, and the amounts are clipped to [1, max_amount].
+    """
+
+    def __init__(self, median: float, sigma: float = 1.0, max_amount: int = None):
+        self.median = median
+        self.sigma = sigma
+        self.max_amount = max_amount
+
+    def __call__(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        amounts = np.round(self.median * np.exp(self.sigma * rng.standard_normal(n)))
+        return np.clip(amounts, 1, self.max_amount)
+
+
+class Workload:
+    """
+    Generates the transactions of a simulation as a stream of chunks of NumPy arrays.
+    The pairs of nodes are drawn from a distribution defined by the subclasses (see _create_pairs_sampler),
+    and the amounts are fixed or drawn from the given amounts sampler.
+    """
+
+    def __init__(self, amounts: Callable[[np.random.Generator, int], np.ndarray] = None):
+        """
+        :param amounts: A function which gets a random generator and n, and returns the amounts of n transactions
+                        (e.g. UniformAmounts), or None to transfer the default amount in all of the transactions.
+                        Note that the simulator does not route each transaction for its exact amount, but for its
+                        amount rounded to an amount bucket (see LightningSimulator.get_amount_buckets), and the
+                        route is priced for the exact amount. So the routes of the amounts of a bucket are the same,
+                        even where their weights in LND differ.
+        """
+        self.amounts = amounts
+
+    def stream(self, graph: CompiledChannelGraph, n_transactions: int, chunk_size: int, default_amount: float,
+               rng: np.random.Generator, excluded_nodes: Sequence[int] = ()) -> Iterator[TransactionsChunk]:
+        """
+        :param graph: The compiled graph of the simulation.
+        :param n_transactions: The number of transactions to generate.
+        :param chunk_size: The maximal number of transactions in a chunk.
+        :param default_amount: The amount of the transactions if there is no amounts sampler.
+        :param rng: The random generator of the transactions.
+        :param excluded_nodes: The indices of the nodes which do not send or receive transactions
+                               (e.g. the agent's node). Their channels are ignored by the weighted workloads.
+        :return: An iterator over the chunks of the transactions.
+        """
+        nodes = np.setdiff1d(np.arange(graph.n_nodes), excluded_nodes)
+        if len(nodes) < 2:
+            raise ValueError("The workload needs at least two nodes to transfer money between")
+        sample_pairs = self._create_pairs_sampler(graph, nodes, rng)
+
+        for chunk_start in range(0, n_transactions, chunk_size):
+            n = min(chunk_size, n_transactions - chunk_start)
+            sources, targets = sample_pairs(rng, n)
+            yield TransactionsChunk(sources, targets, self._sample_amounts(rng, n, default_amount))
+
+    def _create_pairs_sampler(self, graph: CompiledChannelGraph, nodes: np.ndarray, rng: np.random.Generator) \
+            -> Callable[[np.random.Generator, int], Tuple[np.ndarray, np.ndarray]]:
+        """
+        :param graph: The compiled graph of the simulation.
+        :param nodes: The indices of the nodes that can send and receive transactions.
+        :param rng: The random generator of the transactions (for the workloads that have random parameters).
+        :return: A function which gets a random generator and n,
+                 and returns the sources and the targets of n transactions.
+        """
+        raise NotImplementedError("The workload must define the distribution of the pairs of nodes.")
+
+    def _sample_amounts(self, rng: np.random.Generator, n: int, default_amount: float) -> np.ndarray:
+        if self.amounts is None:
+            return np.full(n, default_amount)
+        return self.amounts(rng, n)
+
+
+def get_internal_slots_mask(graph: CompiledChannelGraph, nodes: np.ndarray) -> np.ndarray:
+    """
+    :return: A boolean array indicating for each slot whether both its sender and its receiver are in the given nodes.
+    """
+    is_node_included = np.zeros(graph.n_nodes, dtype=bool)
+    is_node_included[nodes] = True
+    return is_node_included[graph.slot_sender] & is_node_included[graph.slot_receiver]
+
+
+class UniformWorkload(Workload):
+    """
+    The pairs of nodes are drawn uniformly from the ordered pairs of distinct nodes.
+    """
+
+    def _create_pairs_sampler(self, graph, nodes, rng):
+        def sample_pairs(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray]:
+            sources = rng.integers(len(nodes), size=n)
+            targets = rng.integers(len(nodes) - 1, size=n)
+            # The targets are sampled from the nodes which are not the source, so skip over the source.
+            targets += (targets >= sources)
+            return nodes[sources], nodes[targets]
+
+        return sample_pairs
+
+
+class NodeWeightedWorkload(Workload):
+    """
+    The source and the target of each transaction are drawn independently, with probabilities proportional to the
+    weight of each node raised to the power of alpha (pairs of the same node are drawn again).
+    The subclasses define the weights of the nodes (see _get_node_weights).
+    """
+
+    def __init__(self, alpha: float = 1.0, amounts: Callable[[np.random.Generator, int], np.ndarray] = None):
+        """
+        :param alpha: The power to raise the weights. Higher values concentrate the traffic on the heavier nodes.
+        :param amounts: See Workload.
+        """
+        super(NodeWeightedWorkload, self).__init__(amounts)
+        self.alpha = alpha
+
+    def _get_node_weights(self, graph: CompiledChannelGraph, nodes: np.ndarray) -> np.ndarray:
+        """
+        :return: The (non-negative) weight of each of the given nodes.
+        """
+        raise NotImplementedError("The workload must define the weights of the nodes.")
+
+    def _create_pairs_sampler(self, graph, nodes, rng):
+        weights = self._get_node_weights(graph, nodes).astype(np.float64) ** self.alpha
+        if np.count_nonzero(weights) < 2:
+            raise ValueError("The workload needs at least two nodes with a positive weight")
+        p = weights / weights.sum()
+
+        def sample_pairs(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray]:
+            sources = rng.choice(len(nodes), size=n, p=p)
+            targets = rng.choice(len(nodes), size=n, p=p)
+            same = np.flatnonzero(sources == targets)
+            while len(same) > 0:
+                targets[same] = rng.choice(len(nodes), size=len(same), p=p)
+                same = same[sources[same] == targets[same]]
+            return nodes[sources], nodes[targets]
+
+        return sample_pairs
+
+
+class CapacityWeightedWorkload(NodeWeightedWorkload):
+    """
+    The weight of a node is its total capacity (the sum of the capacities of its channels).
+    """
+
+    def _get_node_weights(self, graph, nodes):
+        mask = get_internal_slots_mask(graph, nodes)
+        # Each channel adds its capacity to the senders of both of its slots.
+        capacities = np.bincount(graph.slot_sender[mask], weights=np.repeat(graph.capacity, 2)[mask],
+                                 minlength=graph.n_nodes)
+        return capacities[nodes]
+
+
+class DegreeWeightedWorkload(NodeWeightedWorkload):
+    """
+    The weight of a node is its degree (the number of its channels).
+    """
+
+    def _get_node_weights(self, graph, nodes):
+        mask = get_internal_slots_mask(graph, nodes)
+        return np.bincount(graph.slot_sender[mask], minlength=graph.n_nodes)[nodes]
+
+
+class HotPairsWorkload(Workload):
+    """
+    A few hot pairs of nodes carry most of the traffic:
+    n_pairs distinct ordered pairs are drawn uniformly and ranked, and each transaction picks the pair of rank r
+    with probability proportional to 1 / r ** exponent (a Zipf distribution truncated to n_pairs).
+    """
+
+    def __init__(self, n_pairs: int = 1000, exponent: float = 1.0,
+                 amounts: Callable[[np.random.Generator, int], np.ndarray] = None):
+        """
+        :param n_pairs: The number of pairs that have transactions (at most the number of ordered pairs of nodes).
+        :param exponent: The exponent of the Zipf distribution. Higher values concentrate the traffic on fewer pairs.
+        :param amounts: See Workload.
+        """
+        super(HotPairsWorkload, self).__init__(amounts)
+        self.n_pairs = n_pairs
+        self.exponent = exponent
+
+    def _create_pairs_sampler(self, graph, nodes, rng):
+        # Each ordered pair of distinct nodes is encoded as source * (n - 1) + target,
+        # where the target skips over the source.
+        n_nodes = len(nodes)
+        codes = rng.choice(n_nodes * (n_nodes - 1), size=min(self.n_pairs, n_nodes * (n_nodes - 1)), replace=False)
+        sources, targets = np.divmod(codes, n_nodes - 1)
+        targets += (targets >= sources)
+        hot_sources, hot_targets = nodes[sources], nodes[targets]
+
+        p = 1 / np.arange(1, len(codes) + 1, dtype=np.float64) ** self.exponent
+        p /= p.sum()
+
+        def sample_pairs(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray]:
+            ranks = rng.choice(len(p), size=n, p=p)
+            return hot_sources[ranks], hot_targets[ranks]
+
+        return sample_pairs
+
+
+class ReplayWorkload(Workload):
+    """
+    Replays the transactions in a CSV file with the columns 'source', 'target' (the public keys of the nodes)
+    and optionally 'amount' (rows without an amount use the amounts of the workload).
+    The transactions of nodes that are not in the graph (or are excluded) are skipped, and the file is replayed
+    from its beginning when it ends. The file is read lazily, a chunk at a time.
+    """
+
+    def __init__(self, path: str, amounts: Callable[[np.random.Generator, int], np.ndarray] = None):
+        """
+        :param path: The path of the CSV file.
+        :param amounts: See Workload.
+        """
+        super(ReplayWorkload, self).__init__(amounts)
+        self.path = path
+
+    def stream(self, graph, n_transactions, chunk_size, default_amount, rng, excluded_nodes=()):
+        transactions = self._read_transactions(graph, set(excluded_nodes))
+
+        for chunk_start in range(0, n_transactions, chunk_size):
+            n = min(chunk_size, n_transactions - chunk_start)
+            sources, targets, amounts = map(np.array, zip(*islice(transactions, n)))
+            missing_amounts = np.isnan(amounts)
+            if missing_amounts.any():
+                amounts[missing_amounts] = self._sample_amounts(rng, np.count_nonzero(missing_amounts),
+                                                                default_amount)
+            yield TransactionsChunk(sources, targets, amounts)
+
+    def _read_transactions(self, graph: CompiledChannelGraph, excluded_nodes: set) -> Iterator[Tuple]:
+        """
+        :return: An endless iterator over the (source, target, amount) of the transactions in the file,
+                 where the amount is NaN if it's missing.
+        """
+        while True:
+            n_transactions = 0
+            with open(self.path, newline='') as transactions_file:
+                for row in csv.DictReader(transactions_file):
+                    source = graph.node_index.get(row['source'])
+                    target = graph.node_index.get(row['target'])
+                    if source is None or target is None or source == target \
+                            or source in excluded_nodes or target in excluded_nodes:
+                        continue
+
+                    n_transactions += 1
+                    yield source, target, float(row['amount']) if row.get('amount') else np.nan
+
+            if n_transactions == 0:
+                raise ValueError(f"{self.path} has no transactions between the nodes of the graph")
+
+
+WORKLOADS = {'uniform': UniformWorkload, 'capacity': CapacityWeightedWorkload, 'degree': DegreeWeightedWorkload,
+             'hot-pairs': HotPairsWorkload}
+
+
+def create_workload(name: str = 'uniform', amounts: Callable[[np.random.Generator, int], np.ndarray] = None,
+                    replay_path: str = None) -> Workload:
+    """
+    :param name: The distribution of the pairs of nodes, one of WORKLOADS or 'replay'.
+    :param amounts: The amounts sampler of the workload, or None to transfer a fixed amount.
+    :param replay_path: The path of the CSV file to replay (for the 'replay' workload).
+    :return: The workload.
+    """
+    if name == 'replay':
+        if replay_path is None:
+            raise ValueError("The replay workload needs the path of the transactions file")
+        return ReplayWorkload(replay_path, amounts)
+    if name not in WORKLOADS:
+        raise ValueError(f"Unknown workload {name}, should be one of {list(WORKLOADS) + ['replay']}")
+    return WORKLOADS[name](amounts=amounts)